@@ -1,28 +1,55 @@
-
 import os
+import abc
 import json as _json
 import time
 import base64
 import logging
 import threading
 import ssl
-from typing import Any, Dict, List, Optional, Tuple
+import mmap
+import random
+import struct
+import bisect
+import collections
+import math
+import heapq
+import itertools
+from array import array
+from datetime import datetime
+import gzip
+import hashlib
+import zlib
+import mimetypes
+import re
+from typing import Any, Callable, Dict, Iterator, List, Optional, Tuple, Union
 
 from dotenv import load_dotenv
-from flask import Flask, jsonify, send_from_directory, make_response, Response
+from flask import Flask, g, jsonify, send_from_directory, make_response, request, Response
 from flask_cors import CORS
 import requests
 import websocket
 
+try:
+    import fcntl
+except ImportError:  # Windows: shared snapshot mode unavailable
+    fcntl = None
+
 # -------- Fast JSON (optional orjson) --------
 try:
     import orjson
     def dumps(obj) -> str:
         return orjson.dumps(obj).decode()
 except Exception:
+    orjson = None
     def dumps(obj) -> str:
         return _json.dumps(obj, separators=(",", ":"))
 
+# -------- Optional brotli --------
+try:
+    import brotli
+except Exception:
+    brotli = None
+
 # -------- Bootstrap --------
 load_dotenv()
 logging.basicConfig(level=logging.INFO, format="[%(asctime)s] %(levelname)s: %(message)s")
@@ -38,6 +65,57 @@ NGINX_BASIC_AUTH_PASS = os.getenv("NGINX_BASIC_AUTH_PASS", "")
 REFRESH_SECONDS = float(os.getenv("REFRESH_SECONDS", "1.0"))  # target refresh
 HTTP_TIMEOUT = float(os.getenv("HTTP_TIMEOUT", "8.0"))
 INSECURE_TLS = os.getenv("NEZHA_INSECURE", "false").lower() in {"1", "true", "yes"}
+FRAME_DECODER = os.getenv("FRAME_DECODER", "auto").lower()  # auto | orjson | json
+
+# Federation: JSON list of panels (or a path to a JSON file); unset = the single panel above
+NEZHA_PANELS = os.getenv("NEZHA_PANELS", "").strip()
+UPSTREAM_STALE_SECONDS = float(os.getenv("UPSTREAM_STALE_SECONDS", "0"))  # 0 = keep a silent panel's last data
+
+# Upstream reconnects: a connection silent for N x the usual frame interval is treated as stalled;
+# UPSTREAM_HEDGE keeps a standby websocket per panel that takes over from a stalled or dropped one
+UPSTREAM_STALL_FACTOR = float(os.getenv("UPSTREAM_STALL_FACTOR", "3"))
+UPSTREAM_STALL_MIN_SECONDS = float(os.getenv("UPSTREAM_STALL_MIN_SECONDS", "2"))
+UPSTREAM_HEDGE = os.getenv("UPSTREAM_HEDGE", "false").lower() in {"1", "true", "yes"}
+JWT_REFRESH_MARGIN_SECONDS = 60.0  # log in again this long before the nz-jwt cookie expires
+
+# Shared snapshot: one elected process owns the upstream connection, others read via mmap
+SHARED_SNAPSHOT_PATH = os.getenv("SHARED_SNAPSHOT_PATH", "").strip()
+SHARED_SNAPSHOT_SIZE = int(os.getenv("SHARED_SNAPSHOT_SIZE", str(4 * 1024 * 1024)))
+SHARED_POLL_SECONDS = float(os.getenv("SHARED_POLL_SECONDS", "0.05"))
+
+# Warm start: last snapshot persisted to this file and served (marked restored) until live data arrives
+SNAPSHOT_STATE_PATH = os.getenv("SNAPSHOT_STATE_PATH", "").strip()
+SNAPSHOT_STATE_SECONDS = float(os.getenv("SNAPSHOT_STATE_SECONDS", "5"))
+
+# SSE fan-out
+SSE_HEARTBEAT_SECONDS = float(os.getenv("SSE_HEARTBEAT_SECONDS", "15"))
+SSE_SLOW_CLIENT_SECONDS = float(os.getenv("SSE_SLOW_CLIENT_SECONDS", "10"))  # a single write blocking longer drops the client
+SSE_MAX_CLIENTS = int(os.getenv("SSE_MAX_CLIENTS", "0"))  # 0 = unlimited
+SSE_DELTA_HISTORY = int(os.getenv("SSE_DELTA_HISTORY", "64"))  # patches kept for Last-Event-ID resume
+
+# Traffic history: "<resolution_seconds>:<slots>" per level, finest first
+HISTORY_LEVELS = os.getenv("HISTORY_LEVELS", "1:900,10:8640,60:10080")  # 15 min, 24 h, 7 days
+HISTORY_MAX_POINTS = int(os.getenv("HISTORY_MAX_POINTS", "2000"))
+# An unchanged snapshot is not republished, so its last sample stands in for at most this long;
+# longer gaps (outage, restart) stay empty in the history
+HISTORY_CARRY_SECONDS = float(os.getenv("HISTORY_CARRY_SECONDS", "60"))
+
+# Extra /api/v1/traffic-stats views computed in the aggregation pass (the default country view is always on)
+TRAFFIC_VIEWS = {v.strip() for v in os.getenv("TRAFFIC_VIEWS", "continent,top,servers,status").split(",") if v.strip()}
+TRAFFIC_TOP_MAX = int(os.getenv("TRAFFIC_TOP_MAX", "100"))  # largest n accepted by ?view=top
+SERVER_OFFLINE_SECONDS = float(os.getenv("SERVER_OFFLINE_SECONDS", "30"))  # last_active older than this = offline
+
+# Static bundle served from memory (falls back to disk for anything not indexed)
+STATIC_CACHE = os.getenv("STATIC_CACHE", "true").lower() in {"1", "true", "yes"}
+STATIC_CACHE_MAX_FILE = int(os.getenv("STATIC_CACHE_MAX_FILE", str(16 * 1024 * 1024)))
+
+# Serving engine: flask (this module) | asyncio (app_async.py runs the upstream on its own event loop)
+NEZHA_ENGINE = os.getenv("NEZHA_ENGINE", "flask").lower()
+# false: importing app.py opens no files and starts no threads (tests, benchmarks); call start() to run
+NEZHA_AUTOSTART = os.getenv("NEZHA_AUTOSTART", "true").lower() in {"1", "true", "yes"}
+
+# Prometheus text metrics on /metrics (per process)
+METRICS_ENABLED = os.getenv("METRICS_ENABLED", "true").lower() in {"1", "true", "yes"}
 
 # -------- Country maps --------
 COUNTRY_CODE_TO_NAME_MAP = {
@@ -129,6 +207,34 @@ COUNTRY_EMOJI_CN_MAP = {
     "Northern Mariana Islands": "🇲🇵 北马里亚纳群岛","India": "🇮🇳 印度","Argentina": "🇦🇷 阿根廷","Brazil": "🇧🇷 巴西",
     "Colombia": "🇨🇴 哥伦比亚","Chile": "🇨🇱 智利","Saudi Arabia": "🇸🇦 沙特阿拉伯","Egypt": "🇪🇬 埃及",
 }
+CONTINENT_NAME_CN_MAP = {
+    "Asia": "亚洲", "Europe": "欧洲", "North America": "北美洲", "South America": "南美洲",
+    "Africa": "非洲", "Oceania": "大洋洲",
+}
+_CONTINENT_MEMBERS = {
+    "Asia": [
+        "Singapore", "South Korea", "Japan", "China", "Hong Kong", "Taiwan", "Turkey", "Georgia", "Armenia",
+        "Azerbaijan", "Kazakhstan", "Uzbekistan", "Kyrgyzstan", "Tajikistan", "Turkmenistan", "Afghanistan",
+        "Pakistan", "Bangladesh", "Sri Lanka", "Nepal", "Bhutan", "Maldives", "Malaysia", "Thailand", "Vietnam",
+        "Laos", "Cambodia", "Myanmar", "Philippines", "Indonesia", "Brunei", "East Timor", "India", "Saudi Arabia",
+    ],
+    "Europe": [
+        "Germany", "United Kingdom", "France", "Netherlands", "Italy", "Spain", "Russia", "Sweden", "Norway",
+        "Denmark", "Finland", "Switzerland", "Austria", "Belgium", "Poland", "Czech Republic", "Hungary", "Romania",
+        "Bulgaria", "Croatia", "Slovenia", "Slovakia", "Lithuania", "Latvia", "Estonia", "Ireland", "Portugal",
+        "Greece", "Ukraine", "Belarus", "Moldova", "Serbia", "Bosnia and Herzegovina", "Montenegro",
+        "North Macedonia", "Albania", "Kosovo",
+    ],
+    "North America": ["United States of America", "Canada"],
+    "South America": ["Argentina", "Brazil", "Colombia", "Chile"],
+    "Africa": ["Egypt"],
+    "Oceania": [
+        "Australia", "Papua New Guinea", "Fiji", "New Caledonia", "Vanuatu", "Solomon Islands", "Kiribati", "Tonga",
+        "Samoa", "Tuvalu", "Nauru", "Palau", "Marshall Islands", "Micronesia", "Cook Islands", "Niue", "Tokelau",
+        "American Samoa", "Guam", "Northern Mariana Islands",
+    ],
+}
+COUNTRY_CONTINENT_MAP = {name: continent for continent, names in _CONTINENT_MEMBERS.items() for name in names}
 
 # -------- Utilities --------
 def aggregate_servers_to_countries(servers: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
@@ -167,150 +273,794 @@ def aggregate_servers_to_countries(servers: List[Dict[str, Any]]) -> List[Dict[s
     return output
 
 
-class NezhaStreamer:
+# -------- Metrics --------
+_LATENCY_BUCKETS = (0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0)
+_SIZE_BUCKETS = (1e3, 1e4, 1e5, 2.5e5, 5e5, 1e6, 2.5e6, 5e6, 1e7, 2.5e7, 5e7)
+
+
+def _escape_label(value: Any) -> str:
+    # Text format 0.0.4: backslash, double quote and line feed are escaped in label values
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _fmt_labels(names: Tuple[str, ...], values: Tuple[str, ...], extra: str = "") -> str:
+    parts = [f'{n}="{_escape_label(v)}"' for n, v in zip(names, values)]
+    if extra:
+        parts.append(extra)
+    return "{" + ",".join(parts) + "}" if parts else ""
+
+
+class _HistogramChild:
+    __slots__ = ("buckets", "counts", "sum", "lock")
+
+    def __init__(self, buckets: Tuple[float, ...]) -> None:
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0.0
+        self.lock = threading.Lock()
+
+    def observe(self, value: float) -> None:
+        i = bisect.bisect_left(self.buckets, value)
+        with self.lock:
+            self.counts[i] += 1
+            self.sum += value
+
+
+class _CounterChild:
+    __slots__ = ("value", "lock")
+
+    def __init__(self) -> None:
+        self.value = 0.0
+        self.lock = threading.Lock()
+
+    def inc(self, amount: float = 1.0) -> None:
+        with self.lock:
+            self.value += amount
+
+
+class _Metric(abc.ABC):
+    """Minimal Prometheus metric family, registered for /metrics and rendered in text format 0.0.4."""
+
+    kind = ""
+
+    def __init__(self, name: str, doc: str) -> None:
+        self.name = name
+        self.doc = doc
+        _METRICS.append(self)
+
+    def _header(self) -> List[str]:
+        return [f"# HELP {self.name} {self.doc}", f"# TYPE {self.name} {self.kind}"]
+
+    @abc.abstractmethod
+    def render(self) -> List[str]:
+        ...
+
+
+class _LabelledMetric(_Metric):
+    """Metric recorded in process: one child per label values."""
+
+    def __init__(self, name: str, doc: str, labelnames: Tuple[str, ...] = ()) -> None:
+        super().__init__(name, doc)
+        self.labelnames = labelnames
+        self._children: Dict[Tuple[str, ...], Any] = {}
+        self._lock = threading.Lock()
+
+    def labels(self, *values: Any) -> Any:
+        key = tuple(str(v) for v in values)
+        child = self._children.get(key)
+        if child is None:
+            with self._lock:
+                child = self._children.setdefault(key, self._new_child())
+        return child
+
+    @abc.abstractmethod
+    def _new_child(self) -> Any:
+        ...
+
+    def render(self) -> List[str]:
+        lines = self._header()
+        for key, child in list(self._children.items()):
+            lines.extend(self._render_child(key, child))
+        return lines
+
+    @abc.abstractmethod
+    def _render_child(self, key: Tuple[str, ...], child: Any) -> List[str]:
+        ...
+
+
+class Counter(_LabelledMetric):
+    kind = "counter"
+
+    def _new_child(self) -> _CounterChild:
+        return _CounterChild()
+
+    def inc(self, amount: float = 1.0) -> None:
+        self.labels().inc(amount)
+
+    def _render_child(self, key: Tuple[str, ...], child: _CounterChild) -> List[str]:
+        return [f"{self.name}{_fmt_labels(self.labelnames, key)} {child.value}"]
+
+
+class Gauge(_Metric):
+    """Values are read from a callback at scrape time, so nothing is recorded on the hot path."""
+
+    kind = "gauge"
+
+    def __init__(self, name: str, doc: str, fn: Callable[[], Any]) -> None:
+        super().__init__(name, doc)
+        self._fn = fn
+
+    def render(self) -> List[str]:
+        lines = self._header()
+        value = self._fn()
+        rows = value if isinstance(value, list) else [((), value)]
+        for labels, v in rows:
+            names = tuple(n for n, _ in labels)
+            values = tuple(str(x) for _, x in labels)
+            lines.append(f"{self.name}{_fmt_labels(names, values)} {float(v)}")
+        return lines
+
+
+class Histogram(_LabelledMetric):
+    kind = "histogram"
+
+    def __init__(self, name: str, doc: str, buckets: Tuple[float, ...] = _LATENCY_BUCKETS,
+                 labelnames: Tuple[str, ...] = ()) -> None:
+        super().__init__(name, doc, labelnames)
+        self.buckets = tuple(sorted(buckets))
+
+    def _new_child(self) -> _HistogramChild:
+        return _HistogramChild(self.buckets)
+
+    def observe(self, value: float) -> None:
+        self.labels().observe(value)
+
+    def _render_child(self, key: Tuple[str, ...], child: _HistogramChild) -> List[str]:
+        with child.lock:
+            counts, total = list(child.counts), child.sum
+        lines = []
+        cumulative = 0
+        for bound, n in zip(self.buckets + (float("inf"),), counts):
+            cumulative += n
+            le = 'le="+Inf"' if bound == float("inf") else f'le="{bound!r}"'
+            lines.append(f"{self.name}_bucket{_fmt_labels(self.labelnames, key, le)} {cumulative}")
+        lines.append(f"{self.name}_sum{_fmt_labels(self.labelnames, key)} {total}")
+        lines.append(f"{self.name}_count{_fmt_labels(self.labelnames, key)} {cumulative}")
+        return lines
+
+
+def render_metrics() -> str:
+    lines: List[str] = []
+    for metric in _METRICS:
+        lines.extend(metric.render())
+    return "\n".join(lines) + "\n"
+
+
+_METRICS: List[_Metric] = []
+M_FRAMES = Counter("nezha_upstream_frames_total", "Upstream websocket frames received.", ("panel",))
+M_FRAME_BYTES = Histogram("nezha_upstream_frame_bytes", "Upstream frame size in bytes.", _SIZE_BUCKETS, ("panel",))
+M_PARSE = Histogram("nezha_frame_parse_seconds", "Time to decode one upstream frame.", labelnames=("panel",))
+M_LOCK_WAIT = Histogram("nezha_lock_wait_seconds", "Time spent waiting for the streamer lock.", labelnames=("site",))
+M_AGGREGATE = Histogram("nezha_aggregate_seconds", "Time to fold pending frames into the country sums.")
+M_ENCODE = Histogram("nezha_encode_seconds", "Time to encode and publish one snapshot version.")
+M_RECONNECTS = Counter("nezha_upstream_reconnects_total", "Websocket reconnects after a drop.", ("panel",))
+M_DOWNTIME = Counter("nezha_upstream_downtime_seconds_total", "Time upstream websockets spent disconnected.",
+                     ("panel",))
+M_LOGINS = Counter("nezha_upstream_logins_total", "Successful panel logins (cookie reuse keeps this low).",
+                   ("panel",))
+M_DATA_GAP = Histogram("nezha_upstream_data_gap_seconds", "Time without fresh upstream data, one sample per outage.",
+                       (0.1, 0.25, 0.5, 1.0, 2.0, 5.0, 10.0, 30.0, 60.0, 300.0), ("panel",))
+M_TAKEOVERS = Counter("nezha_upstream_takeovers_total", "Hedged standby connections taking over.", ("panel",))
+M_HTTP = Histogram("nezha_http_request_seconds", "HTTP handler time until the response is returned.",
+                   labelnames=("endpoint", "status"))
+
+
+# -------- Frame decoding --------
+class ServerRecord:
+    """The only per-server fields aggregation needs, kept instead of the full upstream object tree."""
+
+    __slots__ = ("id", "name", "country_code", "net_in_speed", "net_out_speed", "last_active")
+
+    def __init__(self, sid: Any, name: str, country_code: Any, net_in_speed: float, net_out_speed: float,
+                 last_active: Any = None) -> None:
+        self.id = sid
+        self.name = name
+        self.country_code = country_code
+        self.net_in_speed = net_in_speed
+        self.net_out_speed = net_out_speed
+        self.last_active = last_active  # raw upstream value (RFC 3339 string), parsed only when views need it
+
+
+def _pick_loads(name: str) -> Callable[[Union[str, bytes]], Any]:
+    if name in {"auto", "orjson"} and orjson is not None:
+        return orjson.loads
+    if name == "orjson":
+        logging.warning("FRAME_DECODER=orjson but orjson is not installed; using json")
+    return _json.loads
+
+
+_frame_loads = _pick_loads(FRAME_DECODER)
+
+
+def extract_servers(servers: List[Dict[str, Any]]) -> List[ServerRecord]:
+    """Project upstream server dicts onto ServerRecord; same field fallbacks as aggregate_servers_to_countries."""
+    out = []
+    for idx, server in enumerate(servers):
+        if not isinstance(server, dict):
+            continue
+        get = server.get
+        host_info = get("host") or get("Host") or {}
+        status_info = get("state") or get("State") or get("status") or {}
+        out.append(ServerRecord(
+            get("id", idx),
+            get("name") or "",
+            host_info.get("CountryCode") or get("country_code") or "",
+            status_info.get("net_in_speed", 0) or 0,
+            status_info.get("net_out_speed", 0) or 0,
+            get("last_active") or get("LastActive"),
+        ))
+    return out
+
+
+def decode_frame(msg: Union[str, bytes]) -> Optional[List[ServerRecord]]:
     """
-    Persistent session + websocket to Nezha.
-    Event-driven aggregation with <= 1s ceiling.
-    Exposes hot JSON snapshot for HTTP handlers.
+    Default frame decoder: parse with orjson when available (stdlib json otherwise) and keep only
+    compact records. The full tree is dropped as soon as the records are extracted.
+    Returns None for frames without a servers list.
     """
+    data = _frame_loads(msg)
+    servers = data.get("servers") if isinstance(data, dict) else None
+    if not isinstance(servers, list):
+        return None
+    return extract_servers(servers)
 
-    def __init__(self) -> None:
-        self._session = requests.Session()
-        self._need_basic = False
-        self._jwt_cookie_name = "nz-jwt"
-        self._last_servers: List[Dict[str, Any]] = []
-        self._last_msg_ts: float = 0.0
 
-        self._cache_json: str = "[]"
-        self._cache_built_at: float = 0.0
+_RFC3339_FRACTION = re.compile(r"\.(\d+)")
 
-        self._lock = threading.RLock()
-        self._stop = threading.Event()
 
-        # event-driven tick
-        self._tick = threading.Event()
-        self._dirty = False
+def _parse_last_active(value: Any) -> float:
+    """Unix time of an upstream last_active; +inf (counted as online) when it is missing or unparseable."""
+    if not value or not isinstance(value, str):
+        return math.inf
+    # Go's RFC3339Nano ("...05.123456789Z", trailing zeros trimmed) -> what fromisoformat takes before 3.11
+    if value.endswith(("Z", "z")):
+        value = value[:-1] + "+00:00"
+    value = _RFC3339_FRACTION.sub(lambda m: "." + (m.group(1) + "00000")[:6], value, count=1)
+    try:
+        return datetime.fromisoformat(value).timestamp()
+    except ValueError:
+        return math.inf
 
-        self._ws_thread: Optional[threading.Thread] = None
-        self._agg_thread: Optional[threading.Thread] = None
 
-    # ---------- Public ----------
-    def start(self) -> None:
-        if not (self._ws_thread and self._ws_thread.is_alive()):
-            self._stop.clear()
-            self._ws_thread = threading.Thread(target=self._ws_loop, name="NezhaWS", daemon=True)
-            self._ws_thread.start()
+class CountryAggregator:
+    """
+    Incremental version of aggregate_servers_to_countries(), keyed by server id.
+    Keeps each server's last [country, out, in] contribution and only applies differences,
+    so country sums are never rebuilt from scratch, and no frame means no work at all.
 
-        if not (self._agg_thread and self._agg_thread.is_alive()):
-            self._agg_thread = threading.Thread(target=self._aggregate_loop, name="NezhaAgg", daemon=True)
-            self._agg_thread.start()
+    Each upstream panel applies its frames in its own scope (server ids are panel-local).
+    With dedup, a server name already counted by another scope is skipped until that scope drops it.
 
-    def stop(self) -> None:
-        self._stop.set()
-        self._tick.set()
+    Servers whose CountryCode does not map are still tracked (status, top-N) under the name None,
+    which countries() and the per-country views leave out.
 
-    def snapshot(self) -> Tuple[str, float, int, float]:
+    With track_online, the same pass classifies servers as online/offline by last_active and keeps
+    per-country online counts; views() feeds the extra traffic views. last_active is only parsed for
+    new servers: it changes exactly when a server reports, so a changed value means "active now".
+    """
+
+    def __init__(self, dedup: bool = False, track_online: bool = False) -> None:
+        # scope -> server id -> [name, out, in, stamp, key, online, record, last_active_ts]
+        self._contrib: Dict[int, Dict[Any, List[Any]]] = {}
+        self._sums: Dict[Optional[str], List[float]] = {}  # name -> [out, in, server_count, online_count]
+        self._code_to_name: Dict[Any, Optional[str]] = {}  # raw CountryCode -> resolved name
+        self._claims: Optional[Dict[str, List[int]]] = {} if dedup else None  # server name -> [scope, entries]
+        self._track_online = track_online
+        self._stamp = 0
+
+    def apply(self, servers: List[ServerRecord], scope: int = 0) -> bool:
+        """Fold in a full upstream frame for one scope. Returns True if any country sum changed."""
+        contrib = self._contrib.get(scope)
+        if contrib is None:
+            contrib = self._contrib[scope] = {}
+        sums = self._sums
+        resolve = self._code_to_name
+        claims = self._claims
+        track = self._track_online
+        now = time.time()
+        offline_before = now - SERVER_OFFLINE_SECONDS
+        stamp = self._stamp = self._stamp + 1
+        seen = 0
+        changed = False
+        for server in servers or ():
+            code = server.country_code
+            try:
+                name_en = resolve[code]
+            except KeyError:
+                name_en = resolve[code] = COUNTRY_CODE_TO_NAME_MAP.get(str(code).upper()) if code else None
+            key = None
+            if claims is not None and server.name:
+                key = server.name
+                claim = claims.get(key)
+                if claim is not None and claim[0] != scope:
+                    continue  # same server already counted through another panel
+            net_out = server.net_out_speed
+            net_in = server.net_in_speed
+            entry = contrib.get(server.id)
+            if entry is not None:
+                if entry[3] == stamp:
+                    continue  # duplicate id within one frame: first one wins
+                seen += 1
+                entry[3] = stamp
+                if entry[4] != key:
+                    # Renamed: move the claim even when nothing else changed
+                    self._release(entry, scope)
+                    self._claim(key, scope)
+                    entry[4] = key
+                online = True
+                if track:
+                    if server.last_active != entry[6].last_active:
+                        entry[7] = now
+                    online = entry[7] >= offline_before
+                entry[6] = server
+                if entry[0] is name_en and entry[1] == net_out and entry[2] == net_in and entry[5] is online:
+                    continue
+                self._sub(entry)
+                entry[0], entry[1], entry[2], entry[5] = name_en, net_out, net_in, online
+            else:
+                seen += 1
+                active = _parse_last_active(server.last_active) if track else math.inf
+                contrib[server.id] = entry = [name_en, net_out, net_in, stamp, key, active >= offline_before,
+                                              server, active]
+                self._claim(key, scope)
+            d = sums.get(name_en)
+            if d is None:
+                d = sums[name_en] = [0, 0, 0, 0]
+            d[0] += net_out
+            d[1] += net_in
+            d[2] += 1
+            d[3] += entry[5]
+            changed = True
+        if seen != len(contrib):
+            # Servers gone from the frame give back their contribution
+            for sid in [k for k, e in contrib.items() if e[3] != stamp]:
+                entry = contrib.pop(sid)
+                self._sub(entry)
+                self._release(entry, scope)
+            changed = True
+        return changed
+
+    def countries(self) -> List[Dict[str, Any]]:
+        return [{
+            "countryNameEN": name,
+            "countryNameEmojiCN": COUNTRY_EMOJI_CN_MAP.get(name, f"🌐 {name}"),
+            "uplinkSpeed": round((d[0] * 8) / 1e6, 2),
+            "downlinkSpeed": round((d[1] * 8) / 1e6, 2),
+            "coords": COUNTRY_COORDS.get(name, [0, 0]),
+        } for name, d in self._sums.items() if name is not None]
+
+    def views(self, top: int = 0) -> Dict[str, Any]:
         """
-        Returns: (cached_json, cache_age_seconds, server_count, last_msg_age)
+        Raw material for render_view(), speeds in bytes/s: per-country [out, in, servers, online],
+        the same for servers without a mapped country under "unmapped", and, with top, the busiest
+        servers by out+in as [id, name, country or None, out, in, online].
         """
-        with self._lock:
-            now = time.time()
-            cache_age = max(0.0, now - self._cache_built_at)
-            last_msg_age = max(0.0, now - self._last_msg_ts) if self._last_msg_ts else float("inf")
-            count = len(self._last_servers)
-            return self._cache_json, cache_age, count, last_msg_age
+        doc: Dict[str, Any] = {"countries": {name: d[:] for name, d in self._sums.items() if name is not None}}
+        if None in self._sums:
+            doc["unmapped"] = self._sums[None][:]
+        if top > 0:
+            entries = itertools.chain.from_iterable(c.values() for c in self._contrib.values())
+            doc["top"] = [[e[6].id, e[6].name, e[0], e[1], e[2], e[5]]
+                          for e in heapq.nlargest(top, entries, key=lambda e: e[1] + e[2])]
+        return doc
+
+    def _claim(self, key: Optional[str], scope: int) -> None:
+        if key is None:
+            return
+        claim = self._claims.get(key)
+        if claim is None:
+            self._claims[key] = [scope, 1]
+        else:
+            claim[1] += 1  # several ids of one panel may share a name
+
+    def _release(self, entry: List[Any], scope: int) -> None:
+        if self._claims is None or entry[4] is None:
+            return
+        claim = self._claims.get(entry[4])
+        if claim is not None and claim[0] == scope:
+            claim[1] -= 1
+            if claim[1] == 0:
+                del self._claims[entry[4]]
+
+    def _sub(self, entry: List[Any]) -> None:
+        d = self._sums[entry[0]]
+        d[2] -= 1
+        d[3] -= entry[5]
+        if d[2] == 0:
+            del self._sums[entry[0]]  # also drops any float drift
+        else:
+            d[0] -= entry[1]
+            d[1] -= entry[2]
+
+
+class PanelConfig:
+    """One upstream Nezha dashboard and its credentials."""
+
+    __slots__ = ("name", "url", "username", "password", "basic_user", "basic_pass")
+
+    def __init__(self, url: str, username: str, password: str, basic_user: str = "", basic_pass: str = "",
+                 name: str = "") -> None:
+        self.url = url.rstrip("/")
+        self.username = username
+        self.password = password
+        self.basic_user = basic_user
+        self.basic_pass = basic_pass
+        self.name = name or self.url.split("://", 1)[-1]
+
+
+def load_panels() -> List[PanelConfig]:
+    """
+    NEZHA_PANELS: JSON list (or path to a JSON file) of
+    {"name", "url", "username", "password", "nginx_basic_auth_user", "nginx_basic_auth_pass"};
+    missing credentials fall back to the single-panel variables. Unset: the single panel.
+    """
+    if not NEZHA_PANELS:
+        return [PanelConfig(NEZHA_DASHBOARD_URL, NEZHA_USERNAME, NEZHA_PASSWORD,
+                            NGINX_BASIC_AUTH_USER, NGINX_BASIC_AUTH_PASS)]
+    raw = NEZHA_PANELS
+    if not raw.lstrip().startswith("["):
+        with open(raw, encoding="utf-8") as f:
+            raw = f.read()
+    panels = []
+    for item in _json.loads(raw):
+        panels.append(PanelConfig(
+            item["url"],
+            item.get("username", NEZHA_USERNAME),
+            item.get("password", NEZHA_PASSWORD),
+            item.get("nginx_basic_auth_user", NGINX_BASIC_AUTH_USER),
+            item.get("nginx_basic_auth_pass", NGINX_BASIC_AUTH_PASS),
+            item.get("name", ""),
+        ))
+    if not panels:
+        raise ValueError("NEZHA_PANELS is empty")
+    return panels
+
+
+class Backoff:
+    """Reconnect delays: the first retry is immediate, then exponential with jitter so workers spread out."""
+
+    def __init__(self, base: float = 1.0, cap: float = 60.0, factor: float = 1.7) -> None:
+        self.base = base
+        self.cap = cap
+        self.factor = factor
+        self.attempts = 0
+
+    def reset(self) -> None:
+        self.attempts = 0
+
+    def next(self) -> float:
+        self.attempts += 1
+        if self.attempts == 1:
+            return 0.0
+        ceiling = min(self.cap, self.base * self.factor ** (self.attempts - 2))
+        return random.uniform(ceiling / 2, ceiling)
+
+
+def _jwt_expiry(token: str) -> Optional[float]:
+    """exp claim of a JWT (not verified, only used to schedule re-login), or None."""
+    try:
+        payload = token.split(".")[1]
+        claims = _json.loads(base64.urlsafe_b64decode(payload + "=" * (-len(payload) % 4)))
+        return float(claims["exp"])
+    except (IndexError, KeyError, TypeError, ValueError):
+        return None
+
+
+def _is_auth_error(e: Exception) -> bool:
+    # websocket-client: WebSocketBadStatusException.status_code; aiohttp: WSServerHandshakeError.status
+    return (getattr(e, "status_code", None) or getattr(e, "status", None)) in (401, 403)
+
+
+class NezhaUpstream:
+    """
+    Persistent session + websocket to one Nezha panel, with its own thread and backoff.
+    Decoded frames are handed to the owning NezhaStreamer for merging.
+
+    The nz-jwt cookie is reused across reconnects until shortly before it expires (or the panel
+    rejects it), and whether nginx basic auth is needed is remembered. A connection that goes
+    quiet for UPSTREAM_STALL_FACTOR x the usual frame interval counts as stalled. With
+    UPSTREAM_HEDGE a second "lane" keeps a standby websocket open: it receives but does not
+    decode frames, and takes over as soon as the active lane drops, stalls, or has been silent for
+    1.5 frame intervals while the standby is receiving (fresh frames exist, so there is no need
+    to wait out the full stall window).
+    """
+
+    def __init__(self, panel: PanelConfig, scope: int, parent: "NezhaStreamer") -> None:
+        self.panel = panel
+        self.scope = scope
+        self._parent = parent
+        self._session = requests.Session()
+        self._need_basic = False
+        self._jwt_cookie_name = "nz-jwt"
+        self._jwt_expires = 0.0  # wall clock; 0 = log in before the next connect
+        self._login_lock = threading.Lock()
+        self._threads: List[threading.Thread] = []
+        self.ws_url = panel.url.replace("http://", "ws://").replace("https://", "wss://") + "/api/v1/ws/server"
+
+        # Lanes: 0 is the primary connection, 1 the hedged standby
+        self.lanes = 2 if UPSTREAM_HEDGE else 1
+        self._lane_lock = threading.Lock()
+        self._lane_connected = [False] * self.lanes
+        self._lane_last = [0.0] * self.lanes  # monotonic time of each lane's last frame
+        self._active = 0
+        self._interval = 1.0  # smoothed seconds between frames on the active lane
+        self._last_store = 0.0  # monotonic
+        self._gap_since: Optional[float] = None  # set when an outage starts, closed by the next stored frame
+
+        # guarded by parent._lock
+        self.records: List[ServerRecord] = []
+        self.last_msg_ts: float = 0.0
+        self.dirty = False
+        self.connected = False
+        self.reconnects = 0
+        self.logins = 0
+        self.data_gaps = 0
+        self.last_gap_seconds: Optional[float] = None
+        self._down_since: Optional[float] = None
+
+        self._m_frames = M_FRAMES.labels(panel.name)
+        self._m_bytes = M_FRAME_BYTES.labels(panel.name)
+        self._m_parse = M_PARSE.labels(panel.name)
+        self._m_lock = M_LOCK_WAIT.labels("upstream")
+        self._m_reconnects = M_RECONNECTS.labels(panel.name)
+        self._m_downtime = M_DOWNTIME.labels(panel.name)
+        self._m_logins = M_LOGINS.labels(panel.name)
+        self._m_gap = M_DATA_GAP.labels(panel.name)
+        self._m_takeovers = M_TAKEOVERS.labels(panel.name)
+
+    def start(self) -> None:
+        self._threads = [t for t in self._threads if t.is_alive()]
+        if not self._threads:
+            self._threads = [threading.Thread(target=self._ws_loop, args=(lane,), name=f"NezhaWS-{self.scope}-{lane}",
+                                              daemon=True) for lane in range(self.lanes)]
+            for t in self._threads:
+                t.start()
+
+    def status(self) -> Dict[str, Any]:
+        status = {
+            "name": self.panel.name,
+            "url": self.panel.url,
+            "connected": self.connected,
+            "server_count": len(self.records),
+            "last_msg_ts": self.last_msg_ts,
+            "reconnects": self.reconnects,
+            "logins": self.logins,
+            "data_gaps": self.data_gaps,
+            "last_gap_seconds": round(self.last_gap_seconds, 3) if self.last_gap_seconds is not None else None,
+        }
+        if self.lanes > 1:
+            status["standby_connected"] = any(c for lane, c in enumerate(self._lane_connected) if lane != self._active)
+        return status
 
     # ---------- Internal ----------
-    def _login(self) -> bool:
-        url = f"{NEZHA_DASHBOARD_URL}/api/v1/login"
-        payload = {"username": NEZHA_USERNAME, "password": NEZHA_PASSWORD}
-        logging.info("Nezha login: trying without nginx basic auth")
-        try:
-            r = self._session.post(url, json=payload, timeout=HTTP_TIMEOUT, verify=not INSECURE_TLS)
-            if r.ok and (r.json().get("success") is True):
-                self._need_basic = False
-                logging.info("Nezha login ok without basic auth")
+    def _ensure_session(self) -> bool:
+        """Log in only when there is no token or it is about to expire; lanes share one session."""
+        with self._login_lock:
+            if self._jwt_expires - time.time() > JWT_REFRESH_MARGIN_SECONDS:
                 return True
-        except Exception as e:
-            logging.warning(f"Nezha login without basic failed: {e}")
+            if not self._login():
+                return False
+            self.logins += 1
+            self._m_logins.inc()
+            self._jwt_expires = self._token_expiry()
+            return True
 
-        if not (NGINX_BASIC_AUTH_USER and NGINX_BASIC_AUTH_PASS):
-            logging.error("Nezha login failed and no nginx basic auth creds configured")
-            return False
+    def _token_expiry(self) -> float:
+        expires = float("inf")
+        for cookie in self._session.cookies:
+            if cookie.name == self._jwt_cookie_name:
+                if cookie.expires:
+                    expires = min(expires, float(cookie.expires))
+                claimed = _jwt_expiry(cookie.value or "")
+                if claimed is not None:
+                    expires = min(expires, claimed)
+                return expires
+        return 0.0  # no cookie: nothing to reuse
 
-        logging.info("Nezha login: retry with nginx basic auth")
-        try:
-            r = self._session.post(
-                url,
-                json=payload,
-                timeout=HTTP_TIMEOUT,
-                verify=not INSECURE_TLS,
-                auth=(NGINX_BASIC_AUTH_USER, NGINX_BASIC_AUTH_PASS),
-            )
-            if r.ok and (r.json().get("success") is True):
-                self._need_basic = True
-                logging.info("Nezha login ok with nginx basic auth")
-                return True
-            logging.error(f"Nezha login with basic auth failed: {r.status_code} {r.text[:200]}")
-        except Exception as e:
-            logging.error(f"Nezha login with basic auth exception: {e}")
+    def _invalidate_session(self) -> None:
+        with self._login_lock:
+            self._jwt_expires = 0.0
 
+    def _login(self) -> bool:
+        panel = self.panel
+        url = f"{panel.url}/api/v1/login"
+        payload = {"username": panel.username, "password": panel.password}
+        have_basic = bool(panel.basic_user and panel.basic_pass)
+        # Try whatever worked last time first
+        attempts = [True, False] if self._need_basic and have_basic else [False, True]
+        for basic in attempts:
+            if basic and not have_basic:
+                logging.error(f"[{panel.name}] Nezha login failed and no nginx basic auth creds configured")
+                return False
+            how = "with" if basic else "without"
+            logging.info(f"[{panel.name}] Nezha login: trying {how} nginx basic auth")
+            try:
+                r = self._session.post(
+                    url,
+                    json=payload,
+                    timeout=HTTP_TIMEOUT,
+                    verify=not INSECURE_TLS,
+                    auth=(panel.basic_user, panel.basic_pass) if basic else None,
+                )
+                if r.ok and (r.json().get("success") is True):
+                    self._need_basic = basic
+                    logging.info(f"[{panel.name}] Nezha login ok {how} basic auth")
+                    return True
+                logging.warning(f"[{panel.name}] Nezha login {how} basic auth failed: {r.status_code} {r.text[:200]}")
+            except Exception as e:
+                logging.warning(f"[{panel.name}] Nezha login {how} basic auth exception: {e}")
         return False
 
     def _build_ws_headers(self) -> List[str]:
         jwt = self._session.cookies.get(self._jwt_cookie_name, "")
         headers = [f"Cookie: {self._jwt_cookie_name}={jwt}"]
         if self._need_basic:
-            up = f"{NGINX_BASIC_AUTH_USER}:{NGINX_BASIC_AUTH_PASS}"
+            up = f"{self.panel.basic_user}:{self.panel.basic_pass}"
             b64 = base64.b64encode(up.encode()).decode()
             headers.insert(0, f"Authorization: Basic {b64}")
         return headers
 
-    def _ws_loop(self) -> None:
-        backoff = 1.0
-        ws_url = NEZHA_DASHBOARD_URL.replace("http://", "ws://").replace("https://", "wss://") + "/api/v1/ws/server"
-        while not self._stop.is_set():
+    def _stall_after(self) -> float:
+        return max(UPSTREAM_STALL_MIN_SECONDS, UPSTREAM_STALL_FACTOR * self._interval)
+
+    def _accept(self, lane: int) -> bool:
+        """Called for every frame; True if this lane is (now) the active one and the frame should be decoded."""
+        now = time.monotonic()
+        with self._lane_lock:
+            last = self._lane_last
+            if lane != self._active:
+                last[lane] = now
+                active = self._active
+                behind = now - last[active]
+                if self._lane_connected[active] and behind <= self._stall_after() and behind <= 1.5 * self._interval:
+                    return False
+                logging.warning(f"[{self.panel.name}] Lane {active} stalled; lane {lane} takes over")
+                self._active = lane
+                self._m_takeovers.inc()
+                if self._gap_since is None and self._last_store:
+                    self._gap_since = self._last_store
+                return True
+            if last[lane]:
+                self._interval = 0.8 * self._interval + 0.2 * min(now - last[lane], 60.0)
+            last[lane] = now
+            return True
+
+    def _on_stalled(self, lane: int) -> None:
+        # A stall that was a false alarm (slow panel) widens the window for next time
+        with self._lane_lock:
+            if lane == self._active:
+                self._interval = min(self._interval * 2, 60.0)
+
+    def _decode_timed(self, msg: Union[str, bytes]) -> Optional[List[ServerRecord]]:
+        t0 = time.perf_counter()
+        servers = self._parent._decode(msg)
+        self._m_frames.inc()
+        self._m_bytes.observe(len(msg))
+        self._m_parse.observe(time.perf_counter() - t0)
+        return servers
+
+    def _store(self, servers: List[ServerRecord]) -> None:
+        parent = self._parent
+        now = time.monotonic()
+        gap = None
+        with self._lane_lock:
+            if self._gap_since is not None:
+                gap = now - self._gap_since
+                self._gap_since = None
+            self._last_store = now
+        if gap is not None:
+            self._m_gap.observe(gap)
+            logging.info(f"[{self.panel.name}] Data resumed after a {gap:.2f}s gap")
+        t0 = time.perf_counter()
+        with parent._lock:
+            self._m_lock.observe(time.perf_counter() - t0)
+            self.records = servers
+            self.last_msg_ts = time.time()
+            self.dirty = True
+            if gap is not None:
+                self.data_gaps += 1
+                self.last_gap_seconds = gap
+        parent._tick.set()
+
+    def _on_connected(self, lane: int = 0) -> None:
+        suffix = f" (lane {lane})" if self.lanes > 1 else ""
+        logging.info(f"[{self.panel.name}] Websocket connected{suffix}")
+        with self._lane_lock:
+            self._lane_connected[lane] = True
+            self._lane_last[lane] = time.monotonic()
+            self.connected = True
+            if self._down_since is not None:
+                self._m_downtime.inc(time.monotonic() - self._down_since)
+                self._down_since = None
+            if not self._lane_connected[self._active]:
+                self._active = lane
+
+    def _on_dropped(self, lane: int = 0) -> None:
+        with self._lane_lock:
+            was_connected = self._lane_connected[lane]
+            self._lane_connected[lane] = False
+            self.connected = any(self._lane_connected)
+            if not was_connected:
+                return
+            self.reconnects += 1
+            self._m_reconnects.inc()
+            if not self.connected:
+                self._down_since = time.monotonic()
+            if lane == self._active:
+                standby = next((i for i, c in enumerate(self._lane_connected) if c), None)
+                if standby is not None:
+                    self._active = standby
+                    self._m_takeovers.inc()
+                if self._gap_since is None and self._last_store:
+                    self._gap_since = self._last_store
+
+    def _ws_loop(self, lane: int = 0) -> None:
+        parent = self._parent
+        panel = self.panel
+        backoff = Backoff()
+        ws_url = self.ws_url
+        while not parent._stop.is_set():
             ws = None
             try:
-                if not self._login():
-                    time.sleep(min(10.0, backoff))
-                    backoff = min(10.0, backoff * 1.7)
+                if not self._ensure_session():
+                    time.sleep(backoff.next() or backoff.next())  # a failed login is not retried at once
                     continue
 
                 headers = self._build_ws_headers()
                 sslopt = {"cert_reqs": ssl.CERT_NONE} if INSECURE_TLS else None
-                logging.info(f"Connecting websocket: {ws_url}")
+                logging.info(f"[{panel.name}] Connecting websocket: {ws_url}")
                 ws = websocket.create_connection(
                     ws_url,
                     header=headers,
-                    origin=NEZHA_DASHBOARD_URL,
+                    origin=panel.url,
                     sslopt=sslopt,
-                    ping_interval=30,
-                    ping_timeout=10,
+                    timeout=HTTP_TIMEOUT,
+                    # The frame decoder rejects invalid UTF-8 itself; websocket-client's pure-Python
+                    # check costs more than parsing and aggregation combined on large panels
+                    skip_utf8_validation=True,
                 )
-                logging.info("Websocket connected")
-                backoff = 1.0
+                self._on_connected(lane)
 
                 # Receive loop
-                while not self._stop.is_set():
-                    msg = ws.recv()
-                    if not msg:
+                while not parent._stop.is_set():
+                    stall_after = self._stall_after()
+                    ws.settimeout(stall_after)
+                    try:
+                        # Raw bytes: the decoder parses them directly, no str round-trip
+                        opcode, msg = ws.recv_data()
+                    except websocket.WebSocketTimeoutException:
+                        self._on_stalled(lane)
+                        raise RuntimeError(f"No frame for {stall_after:.1f}s")
+                    if opcode not in (websocket.ABNF.OPCODE_TEXT, websocket.ABNF.OPCODE_BINARY) or not msg:
                         raise RuntimeError("Empty websocket frame")
+                    # Only a frame proves the connection works: a peer that accepts the handshake
+                    # and hangs up at once must not earn an immediate retry
+                    backoff.reset()
+                    if not self._accept(lane):
+                        continue  # standby: keep the connection warm, skip decoding
                     try:
-                        data = _json.loads(msg)
+                        servers = self._decode_timed(msg)
                     except Exception:
                         continue
-                    servers = data.get("servers") if isinstance(data, dict) else None
-                    if isinstance(servers, list):
-                        with self._lock:
-                            self._last_servers = servers
-                            self._last_msg_ts = time.time()
-                            self._dirty = True
-                        self._tick.set()
+                    if servers is not None:
+                        self._store(servers)
             except Exception as e:
-                logging.warning(f"Websocket loop error: {e}. Reconnecting in {backoff:.1f}s")
-                time.sleep(min(10.0, backoff))
-                backoff = min(10.0, backoff * 1.7)
+                if _is_auth_error(e):
+                    self._invalidate_session()
+                self._on_dropped(lane)
+                delay = backoff.next()
+                logging.warning(f"[{panel.name}] Websocket loop error: {e}. Reconnecting in {delay:.1f}s")
+                time.sleep(delay)
             finally:
                 try:
                     if ws is not None:
@@ -318,6 +1068,133 @@ class NezhaStreamer:
                 except Exception:
                     pass
 
+
+class NezhaStreamer:
+    """
+    One or more panel upstreams merged into one snapshot.
+    Event-driven aggregation with <= 1s ceiling.
+    Exposes hot JSON snapshot for HTTP handlers.
+    """
+
+    upstream_class = NezhaUpstream
+
+    def __init__(self, shared: Optional["SharedSnapshot"] = None, hub: Optional["SnapshotHub"] = None,
+                 decoder: Callable[[Union[str, bytes]], Optional[List["ServerRecord"]]] = None,
+                 panels: Optional[List[PanelConfig]] = None, state: Optional["SharedSnapshot"] = None) -> None:
+        panels = panels if panels is not None else load_panels()
+        self._decode = decoder or decode_frame
+        # Servers reporting to several panels are counted once (by name) when federating
+        self._aggregator = CountryAggregator(dedup=len(panels) > 1,
+                                             track_online=bool(TRAFFIC_VIEWS & {"servers", "status"}))
+        self._upstreams = [self.upstream_class(p, i, self) for i, p in enumerate(panels)]
+
+        self._cache_json: str = "[]"
+        self._cache_views: str = ""  # CountryAggregator.views() of the same version
+        self._cache_built_at: float = 0.0
+        self._version: int = 0
+        self._shared = shared
+        self._hub = hub
+        self._state = state
+        self._state_saved_at = 0.0
+        # (built_at, last_msg_ts, count) of a snapshot restored from disk, until live data replaces it
+        self._restored: Optional[Tuple[float, float, int]] = None
+
+        self._lock = threading.RLock()
+        self._stop = threading.Event()
+
+        # event-driven tick
+        self._tick = threading.Event()
+
+        self._agg_thread: Optional[threading.Thread] = None
+        if state is not None:
+            self._restore(state)
+
+    # ---------- Public ----------
+    def start(self) -> None:
+        self._stop.clear()
+        if self._shared is not None:
+            self._adopt_shared()
+        for upstream in self._upstreams:
+            upstream.start()
+
+        if not (self._agg_thread and self._agg_thread.is_alive()):
+            self._agg_thread = threading.Thread(target=self._aggregate_loop, name="NezhaAgg", daemon=True)
+            self._agg_thread.start()
+
+    def stop(self) -> None:
+        self._stop.set()
+        self._tick.set()
+
+    def snapshot(self) -> Tuple[str, float, int, float]:
+        """
+        Returns: (cached_json, cache_age_seconds, server_count, last_msg_age)
+        """
+        with self._lock:
+            now = time.time()
+            cache_age = max(0.0, now - self._cache_built_at)
+            last_msg_ts, count = self._totals()
+            last_msg_age = max(0.0, now - last_msg_ts) if last_msg_ts else float("inf")
+            return self._cache_json, cache_age, count, last_msg_age
+
+    def upstreams(self) -> List[Dict[str, Any]]:
+        """Per-panel status; last_msg_ts is absolute so it can be shared across processes."""
+        with self._lock:
+            return [u.status() for u in self._upstreams]
+
+    def restored_at(self) -> Optional[float]:
+        """Build time of the snapshot restored at boot while it is still being served, else None."""
+        restored = self._restored
+        return restored[0] if restored is not None else None
+
+    # ---------- Internal ----------
+    def _totals(self) -> Tuple[float, int]:
+        if self._restored is not None:
+            return self._restored[1], self._restored[2]
+        return max(u.last_msg_ts for u in self._upstreams), sum(len(u.records) for u in self._upstreams)
+
+    def _restore(self, state: "SharedSnapshot") -> None:
+        body, built_at, last_msg_ts, count, version, views = state.read()
+        if version <= 0 or not built_at or body == "[]":
+            return
+        self._cache_json = body
+        self._cache_views = views
+        self._cache_built_at = built_at
+        self._version = version  # live versions continue after it, so the hub sees them as new
+        self._restored = (built_at, last_msg_ts, count)
+        if self._hub is not None:
+            self._hub.publish(version, body, record_history=False, views=views)
+        logging.info(f"Restored snapshot v{version} ({count} servers) from {state.path}, "
+                     f"{time.time() - built_at:.0f}s old")
+
+    def _adopt_shared(self) -> None:
+        """
+        On becoming the owner, carry on from the previous owner's snapshot in the segment unless the
+        state file restored at boot is newer; otherwise the first publish would overwrite fresher data.
+        """
+        body, built_at, _, _, version, views = self._shared.read()
+        if version <= 0 or (self._restored is not None and built_at < self._restored[0]):
+            return
+        with self._lock:
+            self._cache_json, self._cache_views, self._cache_built_at = body, views, built_at
+            self._restored = None
+
+    def _save_state(self, now: float) -> None:
+        # Only one process may write the file; others (e.g. plain multi-worker gunicorn) skip the save
+        if self._restored is not None or self._version <= 0 or now - self._state_saved_at < SNAPSHOT_STATE_SECONDS:
+            return
+        self._state_saved_at = now
+        try:
+            if fcntl is not None:
+                fcntl.flock(self._state.lock_fd(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+            last_msg_ts, count = self._totals()
+            self._state.publish(self._cache_json, self._version, self._cache_built_at, last_msg_ts, count,
+                                views=self._cache_views)
+        except OSError:
+            pass
+
+    def _meta(self) -> str:
+        return dumps({"upstreams": [u.status() for u in self._upstreams], "restored_at": self.restored_at()})
+
     def _aggregate_loop(self) -> None:
         # Recompute immediately at start
         self._tick.set()
@@ -325,15 +1202,879 @@ class NezhaStreamer:
             # Wait for new data or timeout to respect refresh ceiling
             self._tick.wait(timeout=REFRESH_SECONDS)
             self._tick.clear()
-            with self._lock:
-                # Always recompute to keep cache age <= REFRESH_SECONDS
-                cached = aggregate_servers_to_countries(self._last_servers)
-                new_json = dumps(cached)
-                if new_json != self._cache_json:
-                    self._cache_json = new_json
-                # Update build timestamp even if content unchanged
+            self._aggregate_once()
+
+    def _aggregate_once(self) -> bool:
+        """Fold pending frames into the snapshot and publish it. True when a new version was published."""
+        now = time.time()
+        t0 = time.perf_counter()
+        with self._lock:
+            M_LOCK_WAIT.labels("aggregate").observe(time.perf_counter() - t0)
+            pending = []
+            for u in self._upstreams:
+                if UPSTREAM_STALE_SECONDS and u.records and u.last_msg_ts \
+                        and now - u.last_msg_ts > UPSTREAM_STALE_SECONDS:
+                    logging.warning(f"[{u.panel.name}] No data for {UPSTREAM_STALE_SECONDS:.0f}s; dropping its servers")
+                    u.records = []
+                    u.dirty = True
+                if u.dirty:
+                    pending.append((u.scope, u.records))
+                    u.dirty = False
+            if pending:
+                self._restored = None  # live data from here on
+        # Aggregate outside the lock; a tick without a new frame costs nothing
+        if not pending:
+            changed = False
+        else:
+            t0 = time.perf_counter()
+            changed = False
+            for scope, records in pending:
+                changed = self._aggregator.apply(records, scope) or changed
+            M_AGGREGATE.observe(time.perf_counter() - t0)
+        encode_seconds = 0.0
+        if changed:
+            # Every view comes from this one aggregation; an online/offline flip alone is a new version too
+            t0 = time.perf_counter()
+            new_json = dumps(self._aggregator.countries())
+            new_views = dumps(self._aggregator.views(TRAFFIC_TOP_MAX if "top" in TRAFFIC_VIEWS else 0))
+            encode_seconds = time.perf_counter() - t0
+            changed = new_json != self._cache_json or new_views != self._cache_views
+        with self._lock:
+            if changed:
+                self._cache_json = new_json
+                self._cache_views = new_views
+                self._version += 1
+            # Update build timestamp even if content unchanged; a restored snapshot keeps its own age
+            if self._restored is None:
                 self._cache_built_at = time.time()
-                self._dirty = False
+            if self._shared is not None:
+                last_msg_ts, count = self._totals()
+                self._shared.publish(self._cache_json, self._version, self._cache_built_at, last_msg_ts, count,
+                                     self._meta(), self._cache_views)
+            if self._state is not None:
+                self._save_state(now)
+        if changed:
+            if self._hub is not None:
+                t0 = time.perf_counter()
+                self._hub.publish(self._version, new_json, views=new_views)
+                encode_seconds += time.perf_counter() - t0
+            M_ENCODE.observe(encode_seconds)
+        return changed
+
+
+# -------- Shared snapshot (multi-worker) --------
+class SharedSnapshot:
+    """
+    Fixed-size mmap segment holding the latest published snapshot.
+    Single writer (the elected owner), any number of readers; consistency via a seqlock,
+    so neither side ever blocks. Readers decode the body once per version.
+    The views document (CountryAggregator.views()) of the same version follows the body.
+    A small trailing region carries owner metadata (per-upstream status JSON).
+    """
+
+    _MAGIC = b"NZSS"
+    _LAYOUT = 3
+    # magic, layout, seq, version, built_at, last_msg_ts, count, length, epoch, meta_length, views_length
+    _HEADER = struct.Struct("<4sIQQddIIIII")
+    _DATA_OFFSET = 64
+    _META_SIZE = 64 * 1024
+
+    def __init__(self, path: str, size: int = SHARED_SNAPSHOT_SIZE) -> None:
+        self.path = path
+        fd = os.open(path, os.O_RDWR | os.O_CREAT, 0o644)
+        try:
+            if os.fstat(fd).st_size < size:
+                os.ftruncate(fd, size)
+            self._mm = mmap.mmap(fd, size, mmap.MAP_SHARED, mmap.PROT_READ | mmap.PROT_WRITE)
+        finally:
+            os.close(fd)
+        self._capacity = size - self._DATA_OFFSET - self._META_SIZE
+        self._meta_offset = size - self._META_SIZE
+        self._written_version = -1
+        self._lock_fd: Optional[int] = None
+        # reader-side cache, one tuple so concurrent handler threads never see a torn pair
+        self._read_cache: Tuple[int, str, str] = (-1, "[]", "")
+
+    def publish(self, body: str, version: int, built_at: float, last_msg_ts: float, count: int,
+                meta: str = "", views: str = "") -> None:
+        # Segment versions continue from whatever a previous owner left behind, so a reader never
+        # mistakes a new owner's version N for the old owner's version N.
+        magic, layout, seq, seg_version, _, _, _, length, epoch, _, views_length = self._unpack()
+        if magic != self._MAGIC or layout != self._LAYOUT:
+            epoch = random.getrandbits(32)  # fresh segment: new id space for stream resume
+        meta_raw = meta.encode()
+        if len(meta_raw) > self._META_SIZE:
+            meta_raw = b""
+        raw = b""
+        if version != self._written_version:
+            raw = body.encode()
+            views_raw = views.encode()
+            if len(raw) + len(views_raw) > self._capacity:
+                logging.error(f"Snapshot of {len(raw) + len(views_raw)} bytes exceeds shared segment "
+                              f"({self._capacity}); not published")
+                return
+            seg_version += 1
+            length, views_length = len(raw), len(views_raw)
+            raw += views_raw
+        seq = seq + 1 if seq % 2 == 0 else seq
+        # odd seq: writing
+        self._pack(seq, seg_version, built_at, last_msg_ts, count, length, epoch, len(meta_raw), views_length)
+        if raw:
+            self._mm[self._DATA_OFFSET:self._DATA_OFFSET + len(raw)] = raw
+            self._written_version = version
+        self._mm[self._meta_offset:self._meta_offset + len(meta_raw)] = meta_raw
+        self._pack(seq + 1, seg_version, built_at, last_msg_ts, count, length, epoch, len(meta_raw), views_length)
+
+    def read(self) -> Tuple[str, float, float, int, int, str]:
+        """Returns: (body, built_at, last_msg_ts, server_count, version, views)"""
+        for _ in range(100):
+            magic, layout, seq1, version, built_at, last_msg_ts, count, length, _, _, views_length = self._unpack()
+            if magic != self._MAGIC or layout != self._LAYOUT:
+                return "[]", 0.0, 0.0, 0, 0, ""
+            if seq1 % 2:
+                continue
+            cached_version, body, views = self._read_cache
+            if version != cached_version and 0 < length and length + views_length <= self._capacity:
+                raw = self._mm[self._DATA_OFFSET:self._DATA_OFFSET + length + views_length]
+            else:
+                raw = None
+            if self._unpack()[2] != seq1:
+                continue
+            if raw is not None:
+                body, views = raw[:length].decode(), raw[length:].decode()
+                self._read_cache = (version, body, views)
+            return body, built_at, last_msg_ts, count, version, views
+        # Writer kept racing us; serve what we last saw
+        cached_version, body, views = self._read_cache
+        return body, 0.0, 0.0, 0, cached_version, views
+
+    def read_meta(self) -> str:
+        for _ in range(100):
+            header = self._unpack()
+            seq1, meta_length = header[2], header[9]
+            if seq1 % 2 or meta_length > self._META_SIZE:
+                continue
+            raw = self._mm[self._meta_offset:self._meta_offset + meta_length]
+            if self._unpack()[2] == seq1:
+                return raw.decode()
+        return ""
+
+    def lock_fd(self) -> int:
+        """Descriptor on the segment file for writer locks; opened on first use, kept for the process lifetime."""
+        if self._lock_fd is None:
+            self._lock_fd = os.open(self.path, os.O_RDWR)
+        return self._lock_fd
+
+    def epoch(self) -> int:
+        """Random id chosen when the segment was first written; versions are only comparable within one epoch."""
+        return self._unpack()[8]
+
+    def _unpack(self) -> Tuple[bytes, int, int, int, float, float, int, int, int, int, int]:
+        return self._HEADER.unpack_from(self._mm, 0)
+
+    def _pack(self, seq: int, version: int, built_at: float, last_msg_ts: float, count: int, length: int,
+              epoch: int, meta_length: int, views_length: int) -> None:
+        self._HEADER.pack_into(self._mm, 0, self._MAGIC, self._LAYOUT, seq, version, built_at, last_msg_ts,
+                               count, length, epoch, meta_length, views_length)
+
+
+class SharedSnapshotReader:
+    """Same snapshot() contract as NezhaStreamer, served from the shared segment."""
+
+    def __init__(self, shared: SharedSnapshot) -> None:
+        self._shared = shared
+
+    def snapshot(self) -> Tuple[str, float, int, float]:
+        body, built_at, last_msg_ts, count, _, _ = self._shared.read()
+        now = time.time()
+        cache_age = max(0.0, now - built_at) if built_at else float("inf")
+        last_msg_age = max(0.0, now - last_msg_ts) if last_msg_ts else float("inf")
+        return body, cache_age, count, last_msg_age
+
+    def upstreams(self) -> List[Dict[str, Any]]:
+        return self._meta().get("upstreams") or []
+
+    def restored_at(self) -> Optional[float]:
+        return self._meta().get("restored_at")
+
+    def _meta(self) -> Dict[str, Any]:
+        meta = self._shared.read_meta()
+        data = _json.loads(meta) if meta else {}
+        return data if isinstance(data, dict) else {"upstreams": data}  # owner from before restored_at
+
+
+# -------- Traffic history --------
+# Speeds are stored as uint16 codes on a log scale: ~0.012% relative error from 0.01 Mbps up to
+# 10 Pbit/s at half the size of float32, and order-preserving, so min/max work on the codes directly.
+_HISTORY_Q = 65535 / math.log1p(1e7)
+
+
+def _quantise(mbps: float) -> int:
+    return min(65535, int(math.log1p(max(0.0, mbps)) * _HISTORY_Q + 0.5))
+
+
+def _dequantise(code: int) -> float:
+    return math.expm1(code / _HISTORY_Q)
+
+
+def _ring_slices(lo: int, hi: int, slots: int) -> List[Tuple[int, int]]:
+    """Slot ranges covering buckets [lo, hi) of a ring (hi - lo <= slots)."""
+    s, e = lo % slots, (hi - 1) % slots + 1
+    return [(s, e)] if s < e else [(s, slots), (0, e)]
+
+
+class _HistoryLevel:
+    """
+    Ring of buckets at one resolution inside the history buffer. Sample counts are shared by all
+    countries (every record samples every country seen so far); a count of 0 marks a bucket without
+    data. Each country owns one uint16 column per statistic, column-major so downsampling reduces
+    whole slices: the finest level keeps only the mean per direction, coarser levels keep min/mean/max.
+    """
+
+    FULL = ("up_min", "up_avg", "up_max", "down_min", "down_avg", "down_max")
+    MEAN = ("up_avg", "down_avg")
+
+    def __init__(self, resolution: int, slots: int, full: bool, buf: memoryview, offset: int,
+                 buckets: memoryview, index: int, countries: int) -> None:
+        self.resolution = resolution
+        self.slots = slots
+        self.full = full
+        self.stats = self.FULL if full else self.MEAN
+        self._buckets = buckets  # int64 header shared with other processes: first, last per level
+        self._index = index
+        size = slots * 2
+        self.counts = buf[offset:offset + size].cast("H")
+        offset += size
+        self.cols: List[List[memoryview]] = []
+        for _ in range(countries):
+            self.cols.append([buf[offset + k * size:offset + (k + 1) * size].cast("H")
+                              for k in range(len(self.stats))])
+            offset += size * len(self.stats)
+
+    @staticmethod
+    def nbytes_for(slots: int, full: bool, countries: int) -> int:
+        return slots * 2 * (1 + countries * (6 if full else 2))
+
+    @property
+    def first_bucket(self) -> int:
+        return self._buckets[2 * self._index]
+
+    @property
+    def last_bucket(self) -> int:
+        return self._buckets[2 * self._index + 1]
+
+    def record(self, b: int, speeds: Dict[int, Tuple[float, float]], last: Dict[int, Tuple[float, float]],
+               carry_until: int, countries: List[int]) -> None:
+        """Add a sample to bucket b; buckets skipped since the last one repeat last up to carry_until, then stay empty."""
+        last_bucket = self.last_bucket
+        if b < last_bucket:
+            return  # clock went backwards; keep the ring monotonic
+        if b != last_bucket:
+            if last_bucket >= 0:
+                lo = max(last_bucket + 1, b - self.slots + 1)
+                carry = min(b, carry_until + 1)
+                self._clear(lo, b)
+                if lo < carry:
+                    self._fill(lo, carry, last, countries)
+            else:
+                self._buckets[2 * self._index] = b
+            self._fill(b, b + 1, speeds, countries)
+            self._buckets[2 * self._index + 1] = b
+            return
+        slot = b % self.slots
+        n = self.counts[slot] = min(65535, self.counts[slot] + 1)
+        for i in countries:
+            cols = self.cols[i]
+            for value, base in zip(speeds.get(i, (0.0, 0.0)), (0, 3) if self.full else (0, 1)):
+                avg = cols[base + 1] if self.full else cols[base]
+                mean = _dequantise(avg[slot])
+                avg[slot] = _quantise(mean + (value - mean) / n)
+                if self.full:
+                    code = _quantise(value)
+                    if code < cols[base][slot]:
+                        cols[base][slot] = code
+                    if code > cols[base + 2][slot]:
+                        cols[base + 2][slot] = code
+
+    def _clear(self, lo: int, hi: int) -> None:
+        """Mark buckets [lo, hi) empty; their columns are ignored until _fill() rewrites them."""
+        for s, e in _ring_slices(lo, hi, self.slots) if lo < hi else ():
+            self.counts[s:e] = array("H", bytes(2 * (e - s)))
+
+    def _fill(self, lo: int, hi: int, speeds: Dict[int, Tuple[float, float]], countries: List[int]) -> None:
+        """One sample of speeds in every bucket of [lo, hi), by slice assignment."""
+        for s, e in _ring_slices(lo, hi, self.slots):
+            ones = array("H", [1]) * (e - s)
+            self.counts[s:e] = ones
+            for i in countries:
+                up, down = speeds.get(i, (0.0, 0.0))
+                up, down = _quantise(up), _quantise(down)
+                for col, code in zip(self.cols[i], (up, up, up, down, down, down) if self.full else (up, down)):
+                    col[s:e] = array("H", [code]) * (e - s)
+
+
+class TrafficHistory:
+    """
+    Rolling per-country uplink/downlink history (Mbps) at several resolutions with bounded memory.
+    Every level is a preallocated ring in one mmap laid out for every mapped country; the pages of
+    countries never seen are never touched, so the footprint grows with the countries that report
+    (about 230 KB each with the default levels), never with uptime. The mapping itself is the upper
+    bound: 22.4 MB with the default levels and all 98 mapped countries reporting.
+
+    With a path the mmap is a shared file: the process holding the upstream records, every process
+    queries it. Without one it is anonymous memory private to this process.
+    """
+
+    _MAGIC = b"NZHI"
+    _PAGE = 4096
+
+    def __init__(self, levels: str = HISTORY_LEVELS, path: str = "") -> None:
+        parsed = sorted((int(res), int(slots)) for res, slots in (part.split(":") for part in levels.split(",")))
+        self._names = list(COUNTRY_CODE_TO_NAME_MAP.values())
+        self._index = {name: i for i, name in enumerate(self._names)}
+        n = len(self._names)
+        # header: magic, layout id, then first/last bucket per level (int64), then one seen flag per country
+        buckets_at = 8
+        seen_at = buckets_at + 16 * len(parsed)
+        offset = -(-(seen_at + n) // self._PAGE) * self._PAGE
+        layout = []
+        for i, (res, slots) in enumerate(parsed):
+            layout.append((res, slots, i > 0, offset))
+            offset += -(-_HistoryLevel.nbytes_for(slots, i > 0, n) // self._PAGE) * self._PAGE
+        layout_id = zlib.crc32(dumps([layout, self._names]).encode())
+        self._mm = self._map(path, offset, layout_id)
+        buf = memoryview(self._mm)
+        self._buckets = buf[buckets_at:seen_at].cast("q")
+        self._seen = buf[seen_at:seen_at + n]
+        if self._mm[:4] != self._MAGIC:
+            for i in range(len(self._buckets)):
+                self._buckets[i] = -1
+            self._mm[:8] = self._MAGIC + struct.pack("<I", layout_id)
+        self._levels = [_HistoryLevel(res, slots, full, buf, at, self._buckets, i, n)
+                        for i, (res, slots, full, at) in enumerate(layout)]
+        self._last: Dict[int, Tuple[float, float]] = {}
+        self._last_ts = 0.0
+        self._lock = threading.Lock()
+
+    def _map(self, path: str, size: int, layout_id: int) -> mmap.mmap:
+        if not path:
+            return mmap.mmap(-1, size)
+        fd = os.open(path, os.O_RDWR | os.O_CREAT, 0o644)
+        try:
+            header = os.pread(fd, 8, 0)
+            if header != self._MAGIC + struct.pack("<I", layout_id) or os.fstat(fd).st_size != size:
+                os.ftruncate(fd, 0)  # other levels or country map: start over from zeros
+                os.ftruncate(fd, size)
+            return mmap.mmap(fd, size, mmap.MAP_SHARED, mmap.PROT_READ | mmap.PROT_WRITE)
+        finally:
+            os.close(fd)
+
+    def record(self, countries: List[Dict[str, Any]], ts: Optional[float] = None) -> None:
+        ts = time.time() if ts is None else ts
+        speeds = {}
+        for c in countries:
+            i = self._index.get(c["countryNameEN"])
+            if i is not None:
+                speeds[i] = (c["uplinkSpeed"], c["downlinkSpeed"])
+        with self._lock:
+            for i in speeds:
+                self._seen[i] = 1
+            self._record(ts, speeds)
+
+    def countries(self) -> List[str]:
+        return [name for i, name in enumerate(self._names) if self._seen[i]]
+
+    def nbytes(self) -> int:
+        """Bytes of history in use: the rings of the countries seen so far."""
+        seen = sum(self._seen)
+        return sum(_HistoryLevel.nbytes_for(lv.slots, lv.full, seen) for lv in self._levels)
+
+    def query(self, country: str, start: float, end: float, step: Optional[float]) -> Dict[str, Any]:
+        """min/avg/max per step over [start, end), from the finest level still covering start."""
+        i = self._index.get(country)
+        with self._lock:
+            now = time.time()
+            if self._last_ts and now - self._last_ts <= HISTORY_CARRY_SECONDS \
+                    and int(now // self._levels[0].resolution) != self._levels[0].last_bucket:
+                self._record(now, self._last)  # carry forward to now (recording process only)
+            level = next((lv for lv in self._levels
+                          if lv.last_bucket < 0 or (lv.last_bucket - lv.slots + 1) * lv.resolution <= start),
+                         self._levels[-1])
+            first_bucket, last_bucket = level.first_bucket, level.last_bucket
+            # Copy the ring so downsampling never holds up record() (and with it hub.publish)
+            cols = None
+            if i is not None and self._seen[i] and last_bucket >= 0:
+                cols = {name: array("H", col.tobytes()) for name, col in zip(level.stats, level.cols[i])}
+                counts = array("H", level.counts.tobytes())
+        span = max(0.0, end - start)
+        step = max(level.resolution, step or 0, math.ceil(span / HISTORY_MAX_POINTS) if span else 0)
+        per = max(1, int(step // level.resolution))
+        step = per * level.resolution
+        t: List[float] = []
+        series: Dict[str, List[float]] = {k: [] for k in _HistoryLevel.FULL}
+        if cols is not None:
+            # Only buckets the ring still holds, however wide the requested range
+            res = level.resolution
+            lo = max(int(start // res), first_bucket, last_bucket - level.slots + 1)
+            hi = min(int(math.ceil(end / res)), last_bucket + 1)
+            for b0 in range(int(lo // per) * per, hi, per):
+                g_lo, g_hi = max(b0, lo), min(b0 + per, hi)
+                if g_lo >= g_hi:
+                    continue
+                segments = _ring_slices(g_lo, g_hi, level.slots)
+                empty = sum(counts[s:e].count(0) for s, e in segments)
+                if empty == g_hi - g_lo:
+                    continue  # no data (outage or downtime): no point rather than an invented one
+                if empty:
+                    # Drop empty buckets; only groups at the edge of a gap get here
+                    keep = [k for s, e in segments for k in range(s, e) if counts[k]]
+                    segments = [(k, k + 1) for k in keep]
+                t.append(b0 * res)
+                for d in ("up", "down"):
+                    avg = cols[f"{d}_avg"]
+                    lows = cols.get(f"{d}_min", avg)
+                    highs = cols.get(f"{d}_max", avg)
+                    # C-level reductions over slices; codes are monotonic, so min/max need no decoding
+                    series[f"{d}_min"].append(round(_dequantise(min(min(lows[s:e]) for s, e in segments)), 2))
+                    series[f"{d}_max"].append(round(_dequantise(max(max(highs[s:e]) for s, e in segments)), 2))
+                    total = sum(sum(map(_dequantise, avg[s:e])) for s, e in segments)
+                    series[f"{d}_avg"].append(round(total / (g_hi - g_lo - empty), 2))
+        return {
+            "country": country,
+            "from": start,
+            "to": end,
+            "step": step,
+            "resolution": level.resolution,
+            "t": t,
+            "uplinkSpeed": {"min": series["up_min"], "avg": series["up_avg"], "max": series["up_max"]},
+            "downlinkSpeed": {"min": series["down_min"], "avg": series["down_avg"], "max": series["down_max"]},
+        }
+
+    def _record(self, ts: float, speeds: Dict[int, Tuple[float, float]]) -> None:
+        countries = [i for i in range(len(self._names)) if self._seen[i]]
+        # After a restart there is no last sample: the downtime stays empty
+        carry_until = self._last_ts + HISTORY_CARRY_SECONDS if self._last_ts else -1.0
+        for lv in self._levels:
+            lv.record(int(ts // lv.resolution), speeds, self._last, int(carry_until // lv.resolution), countries)
+        self._last = speeds
+        self._last_ts = ts
+
+
+# -------- Binary push format --------
+# Country table with stable indices (map order); its version is a hash of the content, so any map
+# edit yields a new version and clients refetch the table.
+COUNTRY_TABLE: List[Dict[str, Any]] = [{
+    "i": i,
+    "code": code,
+    "countryNameEN": name,
+    "countryNameEmojiCN": COUNTRY_EMOJI_CN_MAP.get(name, f"🌐 {name}"),
+    "coords": COUNTRY_COORDS.get(name, [0, 0]),
+} for i, (code, name) in enumerate(COUNTRY_CODE_TO_NAME_MAP.items())]
+COUNTRY_INDEX: Dict[str, int] = {c["countryNameEN"]: c["i"] for c in COUNTRY_TABLE}
+COUNTRY_TABLE_VERSION = int(hashlib.sha1(_json.dumps(COUNTRY_TABLE, sort_keys=True).encode()).hexdigest()[:8], 16)
+
+# Frame: little-endian header (format, count, table version, snapshot version), then count float32
+# triples (index, uplinkSpeed, downlinkSpeed) in Mbps. 12-byte header keeps the triples 4-byte
+# aligned, so browsers can read them with one Float32Array view.
+BINARY_FORMAT = 1
+_BINARY_HEADER = struct.Struct("<HHII")
+
+
+def encode_binary_frame(version: int, countries: List[Dict[str, Any]]) -> bytes:
+    flat: List[float] = []
+    for c in countries:
+        i = COUNTRY_INDEX.get(c["countryNameEN"])
+        if i is not None:
+            flat.extend((i, c["uplinkSpeed"], c["downlinkSpeed"]))
+    header = _BINARY_HEADER.pack(BINARY_FORMAT, len(flat) // 3, COUNTRY_TABLE_VERSION, version & 0xFFFFFFFF)
+    return header + struct.pack(f"<{len(flat)}f", *flat)
+
+
+def decode_binary_frame(frame: bytes) -> Tuple[int, int, List[Tuple[int, float, float]]]:
+    """Inverse of encode_binary_frame: (table_version, version, [(index, up, down), ...])."""
+    fmt, count, table_version, version = _BINARY_HEADER.unpack_from(frame, 0)
+    if fmt != BINARY_FORMAT:
+        raise ValueError(f"unknown binary frame format {fmt}")
+    values = struct.unpack_from(f"<{count * 3}f", frame, _BINARY_HEADER.size)
+    return table_version, version, [(int(values[k]), values[k + 1], values[k + 2]) for k in range(0, len(values), 3)]
+
+
+# -------- Traffic views --------
+TRAFFIC_VIEW_NAMES = ("countries", "continent", "top", "servers", "status")
+UNMAPPED_COUNTRY = "Unknown"  # servers without a mapped CountryCode in ?view=top and ?view=servers
+# ?unit= for speeds: mbps (the default body, 2 decimals), bps (bit/s) or bytes (bytes/s as the panel reports)
+_UNIT_SCALE = {"mbps": (8, 1e6, 2), "bps": (8, 1, 0), "bytes": (1, 1, 0)}
+
+
+def _speed(value: float, unit: str) -> float:
+    mul, div, digits = _UNIT_SCALE[unit]
+    return round((value * mul) / div, digits) if digits else int(round(value * mul))
+
+
+def parse_view_args(args: Any) -> Tuple[Tuple[str, int, str], Optional[Dict[str, Any]]]:
+    """(view, n, unit) of a /api/v1/traffic-stats query, plus an error payload (for a 400) if it is invalid."""
+    view = (args.get("view") or "countries").strip().lower()
+    unit = (args.get("unit") or "mbps").strip().lower()
+    enabled = [v for v in TRAFFIC_VIEW_NAMES if v == "countries" or v in TRAFFIC_VIEWS]
+    if view not in enabled:
+        return (view, 0, unit), {"status": "error", "message": f"unknown or disabled view: {view}", "views": enabled}
+    if unit not in _UNIT_SCALE:
+        return (view, 0, unit), {"status": "error", "message": f"unit must be one of {', '.join(_UNIT_SCALE)}"}
+    n = 0
+    if view == "top":
+        try:
+            n = max(1, min(int(args.get("n") or 10), TRAFFIC_TOP_MAX))
+        except ValueError:
+            return (view, 0, unit), {"status": "error", "message": "n must be an integer"}
+    elif view in {"servers", "status"}:
+        unit = "mbps"  # no speeds in these, so every unit shares one cached body
+    return (view, n, unit), None
+
+
+def render_view(doc: Dict[str, Any], view: str, n: int = 0, unit: str = "mbps") -> Any:
+    """One /api/v1/traffic-stats view built from a CountryAggregator.views() document."""
+    countries: Dict[str, List[float]] = doc.get("countries") or {}
+    if view == "countries":
+        return [{
+            "countryNameEN": name,
+            "countryNameEmojiCN": COUNTRY_EMOJI_CN_MAP.get(name, f"🌐 {name}"),
+            "uplinkSpeed": _speed(d[0], unit),
+            "downlinkSpeed": _speed(d[1], unit),
+            "coords": COUNTRY_COORDS.get(name, [0, 0]),
+        } for name, d in countries.items()]
+    if view == "continent":
+        totals: Dict[str, List[float]] = {}
+        for name, d in countries.items():
+            t = totals.setdefault(COUNTRY_CONTINENT_MAP.get(name, "Other"), [0, 0, 0, 0])
+            t[0] += d[0]
+            t[1] += d[1]
+            t[2] += d[2]
+            t[3] += 1
+        return [{
+            "continent": continent,
+            "continentNameCN": CONTINENT_NAME_CN_MAP.get(continent, continent),
+            "uplinkSpeed": _speed(t[0], unit),
+            "downlinkSpeed": _speed(t[1], unit),
+            "servers": t[2],
+            "countries": t[3],
+        } for continent, t in sorted(totals.items(), key=lambda kv: kv[1][0] + kv[1][1], reverse=True)]
+    unmapped = doc.get("unmapped")
+    if view == "top":
+        return [{
+            "id": sid,
+            "name": name,
+            "countryNameEN": country or UNMAPPED_COUNTRY,
+            "countryNameEmojiCN": COUNTRY_EMOJI_CN_MAP.get(country, f"🌐 {country or UNMAPPED_COUNTRY}"),
+            "uplinkSpeed": _speed(net_out, unit),
+            "downlinkSpeed": _speed(net_in, unit),
+            "online": online,
+        } for sid, name, country, net_out, net_in, online in (doc.get("top") or [])[:n]]
+    if view == "servers":
+        rows = sorted(countries.items(), key=lambda kv: kv[1][2], reverse=True)
+        if unmapped:
+            rows.append((UNMAPPED_COUNTRY, unmapped))  # no or unknown CountryCode, always last
+        return [{
+            "countryNameEN": name,
+            "countryNameEmojiCN": COUNTRY_EMOJI_CN_MAP.get(name, f"🌐 {name}"),
+            "servers": d[2],
+            "online": d[3],
+            "offline": d[2] - d[3],
+        } for name, d in rows]
+    total = sum(d[2] for d in countries.values()) + (unmapped[2] if unmapped else 0)
+    online = sum(d[3] for d in countries.values()) + (unmapped[3] if unmapped else 0)
+    return {"servers": total, "online": online, "offline": total - online}
+
+
+# -------- Broadcast hub (SSE fan-out) --------
+SSE_HEARTBEAT_FRAME = b": hb\n\n"
+
+
+class EncodedBody:
+    """One snapshot version encoded for HTTP: strong ETag (unquoted) plus identity/gzip/brotli bodies, built once."""
+
+    __slots__ = ("etag", "identity", "gzip", "br")
+
+    def __init__(self, etag: str, body: str) -> None:
+        self.etag = etag
+        self.identity = body.encode()
+        gz = gzip.compress(self.identity, compresslevel=9, mtime=0)
+        self.gzip = gz if len(gz) < len(self.identity) else None
+        br = brotli.compress(self.identity, quality=9) if brotli is not None else None
+        self.br = br if br is not None and len(br) < len(self.identity) else None
+
+    def pick(self, accept_encodings: Any) -> Tuple[bytes, Optional[str]]:
+        """Best precompressed body for an Accept-Encoding; returns (body, content_encoding)."""
+        if self.br is not None and accept_encodings["br"]:
+            return self.br, "br"
+        if self.gzip is not None and accept_encodings["gzip"]:
+            return self.gzip, "gzip"
+        return self.identity, None
+
+
+class SnapshotHub:
+    """
+    Per-process broadcaster for streaming clients.
+    Each new version is encoded into an SSE frame once and shared by every subscriber;
+    subscribers park on a condition and are only woken when a version is published.
+    Slow clients never queue: they skip straight to the newest frame.
+
+    Binary mode: every version is also packed with encode_binary_frame(); SSE carries it base64.
+
+    Views: each version may carry a CountryAggregator.views() document; view() renders and encodes
+    a requested view the first time it is asked for and caches it until the next version.
+
+    Delta mode: every version also gets a keyframe (full body, numbered id) and a patch against the
+    previously published version. The last SSE_DELTA_HISTORY patches are kept so a reconnecting
+    client sending Last-Event-ID only receives what it missed. Event ids are "<epoch>-<version>".
+    """
+
+    def __init__(self, history: Optional[TrafficHistory] = None) -> None:
+        self._history = history
+        self._cond = threading.Condition(threading.Lock())
+        self._epoch = random.getrandbits(32)
+        self._version = 0
+        self._frame = b"data:[]\n\n"
+        self._keyframe = self._encode_keyframe(self._epoch, 0, "[]")
+        self._encoded = EncodedBody(self._make_etag(self._epoch, 0), "[]")
+        self._binary = self._encode_binary(0, [])
+        self._views: Dict[str, Any] = {}
+        self._view_cache: Dict[Tuple[str, int, str], EncodedBody] = {}
+        self._countries: Dict[str, Dict[str, Any]] = {}
+        self._patches: "collections.deque[Tuple[int, int, bytes]]" = collections.deque(maxlen=SSE_DELTA_HISTORY)
+        self._clients = 0
+
+    @property
+    def clients(self) -> int:
+        return self._clients
+
+    @property
+    def version(self) -> int:
+        return self._version
+
+    @property
+    def encoded(self) -> EncodedBody:
+        """Latest version, ready for /api/v1/traffic-stats."""
+        return self._encoded
+
+    @property
+    def binary(self) -> Tuple[int, bytes, bytes]:
+        """Latest version as (version, binary frame, base64 SSE frame)."""
+        return self._binary
+
+    def cached_view(self, view: str, n: int = 0, unit: str = "mbps") -> Optional[EncodedBody]:
+        """view() if it is already encoded for the latest version, else None."""
+        if view == "countries" and unit == "mbps":
+            return self._encoded
+        return self._view_cache.get((view, n, unit))
+
+    def view(self, view: str, n: int = 0, unit: str = "mbps") -> EncodedBody:
+        """Latest version rendered as a parse_view_args() view; encoded once per version."""
+        encoded = self.cached_view(view, n, unit)
+        if encoded is not None:
+            return encoded
+        with self._cond:
+            version, epoch, doc, cache = self._version, self._epoch, self._views, self._view_cache
+        key = (view, n, unit)
+        encoded = cache.get(key)
+        if encoded is None:
+            t0 = time.perf_counter()
+            encoded = cache[key] = EncodedBody(f"{self._make_etag(epoch, version)}-{view}-{n}-{unit}",
+                                               dumps(render_view(doc, view, n, unit)))
+            M_ENCODE.observe(time.perf_counter() - t0)
+        return encoded
+
+    def publish(self, version: int, body: str, epoch: Optional[int] = None, record_history: bool = True,
+                views: str = "") -> None:
+        # All encoding happens here, in the publishing thread, never per request
+        frame = f"data:{body}\n\n".encode()
+        countries = {c["countryNameEN"]: c for c in _json.loads(body)}
+        encoded = EncodedBody(self._make_etag(self._epoch if epoch is None else epoch, version), body)
+        binary = self._encode_binary(version, list(countries.values()))
+        doc = _json.loads(views) if views else {}
+        with self._cond:
+            if epoch is not None and epoch != self._epoch:
+                # New id space (e.g. shared segment recreated): old patches cannot be chained
+                self._epoch = epoch
+                self._patches.clear()
+            elif version == self._version:
+                return
+            else:
+                patch = self._encode_patch(self._epoch, self._version, version, self._countries, countries)
+                self._patches.append((self._version, version, patch))
+            self._version, self._frame, self._countries = version, frame, countries
+            self._keyframe = self._encode_keyframe(self._epoch, version, body)
+            self._encoded = encoded
+            self._binary = binary
+            self._views, self._view_cache = doc, {}
+            self._cond.notify_all()
+        if self._history is not None and record_history:
+            self._history.record(list(countries.values()))
+
+    def wait(self, after_version: int, timeout: float) -> Tuple[int, bytes]:
+        """Block until a version other than after_version is available, or timeout."""
+        with self._cond:
+            if self._version == after_version:
+                self._cond.wait(timeout)
+            return self._version, self._frame
+
+    def delta_frames(self, after_version: int) -> Tuple[int, List[bytes]]:
+        """Patches taking a client from after_version to the latest, or the keyframe if they are gone."""
+        with self._cond:
+            if after_version == self._version:
+                return self._version, []
+            frames: List[bytes] = []
+            for base, version, patch in self._patches:
+                if frames or base == after_version:
+                    frames.append(patch)
+            return self._version, frames or [self._keyframe]
+
+    def parse_event_id(self, event_id: Optional[str]) -> int:
+        """Version from a Last-Event-ID header, or -1 when it is missing or from another epoch."""
+        try:
+            epoch, version = (event_id or "").split("-", 1)
+            return int(version) if int(epoch) == self._epoch else -1
+        except ValueError:
+            return -1
+
+    def try_subscribe(self) -> bool:
+        with self._cond:
+            if SSE_MAX_CLIENTS and self._clients >= SSE_MAX_CLIENTS:
+                return False
+            self._clients += 1
+            return True
+
+    def unsubscribe(self) -> None:
+        with self._cond:
+            self._clients -= 1
+
+    def stream(self, delta: bool = False, last_version: int = -1, binary: bool = False,
+               sock: Optional[Any] = None) -> Iterator[bytes]:
+        """
+        SSE body for one subscriber. Pair with try_subscribe()/unsubscribe().
+        sock is the client socket when the WSGI server exposes it: it gets a send timeout of
+        SSE_SLOW_CLIENT_SECONDS, so a client that stops reading cannot pin the worker thread in send().
+        """
+        prev_timeout = None
+        if sock is not None:
+            prev_timeout = sock.gettimeout()
+            sock.settimeout(SSE_SLOW_CLIENT_SECONDS)
+        try:
+            yield from self._stream(delta, last_version, binary)
+        finally:
+            if sock is not None:
+                try:
+                    sock.settimeout(prev_timeout)  # keep-alive reuse gets the server's own setting back
+                except OSError:
+                    pass
+
+    def _stream(self, delta: bool, last_version: int, binary: bool) -> Iterator[bytes]:
+        version = last_version if delta else -1
+        while True:
+            v, frame = self.wait(version, SSE_HEARTBEAT_SECONDS)
+            if v == version:
+                frame = SSE_HEARTBEAT_FRAME
+            elif delta:
+                v, frames = self.delta_frames(version)
+                frame = b"".join(frames)
+            elif binary:
+                v, _, frame = self._binary
+            version = v
+            t0 = time.monotonic()
+            yield frame
+            # Without a socket to time out (server does not expose it), at least stop once a write
+            # that eventually completed took too long; the server only resumes us after it is out
+            if time.monotonic() - t0 > SSE_SLOW_CLIENT_SECONDS:
+                logging.info("Dropping slow SSE client")
+                return
+
+    @staticmethod
+    def _encode_binary(version: int, countries: List[Dict[str, Any]]) -> Tuple[int, bytes, bytes]:
+        frame = encode_binary_frame(version, countries)
+        return version, frame, b"data:" + base64.b64encode(frame) + b"\n\n"
+
+    @staticmethod
+    def _make_etag(epoch: int, version: int) -> str:
+        return f"{epoch:x}-{version}"
+
+    @staticmethod
+    def _encode_keyframe(epoch: int, version: int, body: str) -> bytes:
+        return f"id:{epoch}-{version}\nevent:keyframe\ndata:{body}\n\n".encode()
+
+    @staticmethod
+    def _encode_patch(epoch: int, base: int, version: int,
+                      old: Dict[str, Dict[str, Any]], new: Dict[str, Dict[str, Any]]) -> bytes:
+        # set: {name: [uplinkSpeed, downlinkSpeed]} for moved speeds; add: full entries; del: names
+        patch: Dict[str, Any] = {"v": version, "base": base}
+        changed = {}
+        added = []
+        for name, c in new.items():
+            prev = old.get(name)
+            if prev is None:
+                added.append(c)
+            elif prev["uplinkSpeed"] != c["uplinkSpeed"] or prev["downlinkSpeed"] != c["downlinkSpeed"]:
+                changed[name] = [c["uplinkSpeed"], c["downlinkSpeed"]]
+        removed = [name for name in old if name not in new]
+        if changed:
+            patch["set"] = changed
+        if added:
+            patch["add"] = added
+        if removed:
+            patch["del"] = removed
+        return f"id:{epoch}-{version}\nevent:patch\ndata:{dumps(patch)}\n\n".encode()
+
+
+def _watch_shared() -> None:
+    """Feed the local hub from the shared segment (shared snapshot mode)."""
+    last = (-1, -1)
+    while True:
+        body, _, _, _, version, views = _shared.read()
+        epoch = _shared.epoch()
+        if (epoch, version) != last and version > 0:
+            last = (epoch, version)
+            try:
+                hub.publish(version, body, epoch, record_history=_role == "owner", views=views)
+            except Exception as e:
+                logging.error(f"Shared snapshot v{version} could not be published locally: {e}")
+        time.sleep(SHARED_POLL_SECONDS)
+
+
+def _elect_and_stream(lock_path: str) -> None:
+    """Block until this process holds the owner lock, then run the upstream streamer here."""
+    global _role, _lock_fd
+    fd = os.open(lock_path, os.O_RDWR | os.O_CREAT, 0o644)
+    fcntl.flock(fd, fcntl.LOCK_EX)  # released by the kernel when the owner exits
+    _lock_fd = fd
+    _role = "owner"
+    logging.info(f"Elected as upstream owner (pid {os.getpid()})")
+    streamer.start()
+
+
+def _start_streaming() -> None:
+    global _role
+    if _shared is None:
+        _role = "standalone"
+        streamer.start()
+        return
+    _role = "reader"
+    threading.Thread(target=_watch_shared, name="NezhaShmWatch", daemon=True).start()
+    threading.Thread(target=_elect_and_stream, args=(SHARED_SNAPSHOT_PATH + ".lock",),
+                     name="NezhaElect", daemon=True).start()
+
+
+def _after_fork_in_child() -> None:
+    # gunicorn --preload: the master may already own the lock. The child's copy of the fd shares
+    # the master's lock, so drop it and contend with a fresh one; threads did not survive the fork.
+    global streamer, _lock_fd
+    if _shared is None:
+        return
+    if _lock_fd is not None:
+        try:
+            os.close(_lock_fd)
+        except OSError:
+            pass
+        _lock_fd = None
+    streamer = NezhaStreamer(shared=_shared, state=_state)  # shared mode: the hub is fed by _watch_shared
+    _start_streaming()
 
 
 # -------- Flask app --------
@@ -341,50 +2082,308 @@ class NezhaStreamer:
 app = Flask(__name__, static_folder=None)
 CORS(app, resources={r"/api/*": {"origins": "*"}})
 
-streamer = NezhaStreamer()
-streamer.start()
+_shared: Optional[SharedSnapshot] = None
+if SHARED_SNAPSHOT_PATH and NEZHA_ENGINE == "flask" and NEZHA_AUTOSTART:
+    if fcntl is None:
+        logging.warning("SHARED_SNAPSHOT_PATH set but fcntl is unavailable; running standalone")
+    else:
+        _shared = SharedSnapshot(SHARED_SNAPSHOT_PATH)
+_role = "standalone"
+_lock_fd: Optional[int] = None
+
+_state: Optional[SharedSnapshot] = None
+if SNAPSHOT_STATE_PATH and NEZHA_AUTOSTART:
+    try:
+        os.makedirs(os.path.dirname(os.path.abspath(SNAPSHOT_STATE_PATH)), exist_ok=True)
+        _state = SharedSnapshot(SNAPSHOT_STATE_PATH, 1024 * 1024)  # same seqlock layout; torn writes are detected
+    except OSError as e:
+        logging.warning(f"Snapshot state file {SNAPSHOT_STATE_PATH} unavailable, warm start disabled: {e}")
+
+# Shared snapshot mode: one history file, written by the owner only, queried by every worker
+history = TrafficHistory(path=SHARED_SNAPSHOT_PATH + ".history" if _shared is not None else "")
+hub = SnapshotHub(history)
+country_table = EncodedBody(f"t{COUNTRY_TABLE_VERSION:08x}", dumps({
+    "version": COUNTRY_TABLE_VERSION, "format": BINARY_FORMAT, "countries": COUNTRY_TABLE,
+}))
+# The asyncio engine restores the state file into its own streamer
+streamer = NezhaStreamer(shared=_shared, hub=hub if _shared is None else None,
+                         state=_state if NEZHA_ENGINE == "flask" else None)
+source = SharedSnapshotReader(_shared) if _shared is not None else streamer
+
+
+def start() -> None:
+    """Run the Flask engine's upstream in this process (done on import unless NEZHA_AUTOSTART=false)."""
+    _start_streaming()
+    if hasattr(os, "register_at_fork"):
+        os.register_at_fork(after_in_child=_after_fork_in_child)
+
+
+if NEZHA_ENGINE == "flask" and NEZHA_AUTOSTART:
+    start()
+
+
+def _snapshot_gauge(index: int) -> Callable[[], float]:
+    def read() -> float:
+        value = source.snapshot()[index]
+        return value if value != float("inf") else -1.0
+    return read
+
+
+def _upstream_gauge(key: str) -> Callable[[], List[Tuple[Tuple[Tuple[str, Any], ...], float]]]:
+    def read() -> List[Tuple[Tuple[Tuple[str, Any], ...], float]]:
+        return [((("panel", u.get("name", "")),), float(u.get(key) or 0)) for u in source.upstreams()]
+    return read
+
+
+Gauge("nezha_sse_clients", "Open /api/v1/traffic-stream connections in this process.", lambda: hub.clients)
+Gauge("nezha_snapshot_version", "Latest snapshot version published to this process.", lambda: hub.version)
+Gauge("nezha_snapshot_age_seconds", "Seconds since the snapshot was last rebuilt.", _snapshot_gauge(1))
+Gauge("nezha_last_message_age_seconds", "Seconds since the last upstream frame (-1 = never).", _snapshot_gauge(3))
+Gauge("nezha_servers", "Servers in the current snapshot.", _snapshot_gauge(2))
+Gauge("nezha_upstream_connected", "1 while the panel websocket is connected.", _upstream_gauge("connected"))
+Gauge("nezha_process_role", "Role of this process in shared snapshot mode.", lambda: [((("role", _role),), 1)])
+
+if METRICS_ENABLED:
+    @app.before_request
+    def _metrics_start() -> None:
+        g.metrics_t0 = time.perf_counter()
+
+    @app.after_request
+    def _metrics_observe(resp: Response) -> Response:
+        t0 = g.get("metrics_t0")
+        if t0 is not None:
+            # Route templates keep label cardinality bounded; everything else is "other"
+            rule = request.url_rule.rule if request.url_rule is not None else "other"
+            M_HTTP.labels(rule, resp.status_code).observe(time.perf_counter() - t0)
+        return resp
 
 # ---- API ----
 @app.route("/test")
 def test():
     return "Flask app is working!"
 
-@app.route("/api/v1/test-connection")
-def test_connection():
-    body, cache_age, count, last_msg_age = streamer.snapshot()
-    return jsonify({
-        "status": "ok" if count > 0 else "stale",
+def connection_status() -> Dict[str, Any]:
+    """Payload of /api/v1/test-connection, shared by both engines."""
+    body, cache_age, count, last_msg_age = source.snapshot()
+    now = time.time()
+    upstreams = []
+    for u in source.upstreams():
+        ts = u.pop("last_msg_ts", 0)
+        u["last_message_age_seconds"] = round(max(0.0, now - ts), 3) if ts else None
+        upstreams.append(u)
+    restored_at = source.restored_at()
+    if restored_at is not None:
+        status = "restored"  # serving the snapshot persisted before the last restart, not live data
+    else:
+        status = "ok" if count > 0 else "stale"
+    return {
+        "status": status,
+        "restored_age_seconds": round(max(0.0, now - restored_at), 3) if restored_at is not None else None,
+        "role": _role,
         "server_count": count,
         "cache_age_seconds": round(cache_age, 3),
         "last_message_age_seconds": round(last_msg_age, 3) if last_msg_age != float("inf") else None,
         "refresh_seconds": REFRESH_SECONDS,
-    })
+        "upstreams": upstreams,
+    }
+
+
+def history_payload(args: Any) -> Tuple[Dict[str, Any], int]:
+    """Payload and status of /api/v1/traffic-history for a mapping of query args."""
+    country = (args.get("country") or "").strip()
+    country = COUNTRY_CODE_TO_NAME_MAP.get(country.upper(), country)
+    if not country:
+        return {"status": "error", "message": "country is required", "countries": history.countries()}, 400
+    try:
+        end = float(args.get("to") or time.time())
+        start = float(args.get("from") or end - 3600)
+        step = float(args["step"]) if args.get("step") else None
+    except ValueError:
+        return {"status": "error", "message": "from/to/step must be numbers"}, 400
+    if not all(math.isfinite(v) for v in (start, end, step or 0)):
+        return {"status": "error", "message": "from/to/step must be finite"}, 400
+    if start >= end:
+        return {"status": "error", "message": "from must be before to"}, 400
+    return history.query(country, start, end, step), 200
+
+
+@app.route("/api/v1/test-connection")
+def test_connection():
+    return jsonify(connection_status())
+
+def _encoded_response(encoded: EncodedBody, cache_control: str = "no-cache") -> Response:
+    """304 on If-None-Match, otherwise the best precompressed JSON body."""
+    if request.if_none_match.contains(encoded.etag):
+        resp = make_response("", 304)
+    else:
+        body, encoding = encoded.pick(request.accept_encodings)
+        resp = make_response(body, 200)
+        resp.headers["Content-Type"] = "application/json"
+        if encoding:
+            resp.headers["Content-Encoding"] = encoding
+    resp.set_etag(encoded.etag)
+    resp.headers["Vary"] = "Accept-Encoding"
+    resp.headers["Cache-Control"] = cache_control
+    return resp
 
 @app.route("/api/v1/traffic-stats")
 def traffic_stats():
-    body, cache_age, _, _ = streamer.snapshot()
-    resp = make_response(body, 200)
-    resp.headers["Content-Type"] = "application/json"
-    resp.headers["Cache-Control"] = "no-store"
+    """
+    Latest snapshot; strong ETag per version, 304 on If-None-Match, precompressed gzip/brotli bodies.
+    ?view=countries|continent|top|servers|status, ?n= for top, ?unit=mbps|bps|bytes (see render_view).
+    """
+    key, error = parse_view_args(request.args)
+    if error is not None:
+        return jsonify(error), 400
+    _, cache_age, _, _ = source.snapshot()
+    resp = _encoded_response(hub.view(*key))
     resp.headers["X-Data-Age-Seconds"] = f"{cache_age:.3f}"
+    if source.restored_at() is not None:
+        resp.headers["X-Data-Restored"] = "1"
     return resp
 
+@app.route("/api/v1/country-table")
+def country_table_route():
+    """Index table for binary frames; only changes when the country maps do."""
+    return _encoded_response(country_table, "public, max-age=86400")
+
+@app.route("/api/v1/traffic-history")
+def traffic_history():
+    """
+    Downsampled per-country history: ?country=<name or code>&from=&to=&step= (unix seconds).
+    Defaults to the last hour; each point carries min/avg/max of uplink and downlink Mbps.
+    """
+    payload, status = history_payload(request.args)
+    return jsonify(payload), status
+
 @app.route("/api/v1/traffic-stream")
 def traffic_stream():
-    """Server-Sent Events stream of the aggregated JSON. Emits only on change, with light debounce."""
-    def gen():
-        last = None
-        while True:
-            body, _, _, _ = streamer.snapshot()
-            if body != last:
-                yield f"data:{body}\n\n"
-                last = body
-            time.sleep(0.2)
-    return Response(gen(), mimetype="text/event-stream")
+    """
+    Server-Sent Events stream of the aggregated JSON. Emits only on change, plus heartbeat comments.
+    ?mode=delta: one keyframe, then numbered patches; resumes from Last-Event-ID when possible.
+    ?mode=binary: base64 binary frames (see /api/v1/country-table).
+    """
+    mode = request.args.get("mode")
+    delta = mode == "delta"
+    last_version = hub.parse_event_id(request.headers.get("Last-Event-ID")) if delta else -1
+    if not hub.try_subscribe():
+        return jsonify({"status": "busy", "message": "too many stream clients"}), 503
+    sock = request.environ.get("gunicorn.socket") or request.environ.get("werkzeug.socket")
+    resp = Response(hub.stream(delta, last_version, binary=mode == "binary", sock=sock),
+                    mimetype="text/event-stream")
+    resp.call_on_close(hub.unsubscribe)
+    resp.headers["Cache-Control"] = "no-cache"
+    resp.headers["X-Accel-Buffering"] = "no"
+    return resp
+
+@app.route("/metrics")
+def metrics():
+    """Prometheus text exposition. Per process: under gunicorn each scrape sees one worker."""
+    if not METRICS_ENABLED:
+        return jsonify({"status": "error", "message": "metrics disabled"}), 404
+    return Response(render_metrics(), mimetype="text/plain; version=0.0.4")
 
 # ---- Static and UI ----
+class StaticAsset:
+    """One bundled file held in memory with its precompressed variants."""
+
+    __slots__ = ("body", "gzip", "br", "mimetype", "etag", "cache_control")
+
+    def __init__(self, body: bytes, mimetype: str, immutable: bool) -> None:
+        self.body = body
+        self.mimetype = mimetype
+        self.etag = hashlib.sha1(body).hexdigest()[:20]
+        # Content-hashed bundles never change under the same URL; everything else revalidates
+        self.cache_control = "public, max-age=31536000, immutable" if immutable else "no-cache"
+        self.gzip = self.br = None
+        if _is_compressible(mimetype):
+            gz = gzip.compress(body, compresslevel=9, mtime=0)
+            self.gzip = gz if len(gz) < len(body) else None
+            if brotli is not None:
+                br = brotli.compress(body, quality=9)
+                self.br = br if len(br) < len(body) else None
+
+    def response(self) -> Response:
+        if request.if_none_match.contains(self.etag):
+            resp = make_response("", 304)
+        else:
+            body, encoding = self.body, None
+            if self.br is not None and request.accept_encodings["br"]:
+                body, encoding = self.br, "br"
+            elif self.gzip is not None and request.accept_encodings["gzip"]:
+                body, encoding = self.gzip, "gzip"
+            resp = make_response(body, 200)
+            resp.headers["Content-Type"] = self.mimetype
+            if encoding:
+                resp.headers["Content-Encoding"] = encoding
+        if self.gzip is not None or self.br is not None:
+            resp.headers["Vary"] = "Accept-Encoding"
+        resp.set_etag(self.etag)
+        resp.headers["Cache-Control"] = self.cache_control
+        return resp
+
+
+_HASHED_NAME = re.compile(r"\.[0-9a-f]{8,}\.")
+
+
+def _is_compressible(mimetype: str) -> bool:
+    base = mimetype.split(";")[0]
+    return base.startswith("text/") or base in {
+        "application/javascript", "application/json", "application/manifest+json",
+        "image/svg+xml", "image/x-icon", "image/vnd.microsoft.icon",
+    }
+
+
+def _load_static_index(static_root: str) -> Dict[str, StaticAsset]:
+    """
+    Map request paths to in-memory assets with the same two-layer lookup as _send_from_two_layers:
+    static/<path> wins, then static/static/<path>.
+    """
+    immutable = set()
+    try:
+        with open(os.path.join(static_root, "asset-manifest.json"), encoding="utf-8") as f:
+            manifest = _json.load(f)
+        for rel in (manifest.get("files") or {}).values():
+            rel = os.path.normpath(rel.lstrip("/")).replace(os.sep, "/")
+            if _HASHED_NAME.search(os.path.basename(rel)):
+                immutable.add(rel)
+    except (OSError, ValueError) as e:
+        logging.info(f"No usable asset-manifest.json, hashed bundles get revalidation only: {e}")
+
+    index: Dict[str, StaticAsset] = {}
+    nested: Dict[str, StaticAsset] = {}
+    total = 0
+    for dirpath, _, filenames in os.walk(static_root):
+        for name in filenames:
+            full = os.path.join(dirpath, name)
+            rel = os.path.relpath(full, static_root).replace(os.sep, "/")
+            if os.path.getsize(full) > STATIC_CACHE_MAX_FILE:
+                continue
+            with open(full, "rb") as f:
+                body = f.read()
+            mimetype = mimetypes.guess_type(name)[0] or "application/octet-stream"
+            if mimetype.startswith("text/"):
+                mimetype += "; charset=utf-8"
+            asset = StaticAsset(body, mimetype, rel in immutable)
+            index[rel] = asset
+            if rel.startswith("static/"):
+                nested[rel[len("static/"):]] = asset
+            total += len(body)
+    for rel, asset in nested.items():
+        index.setdefault(rel, asset)
+    logging.info(f"Static cache: {len(index)} paths, {total / 1e6:.1f} MB, {len(immutable)} immutable")
+    return index
+
+
+_static_index: Dict[str, StaticAsset] = (_load_static_index(os.path.join(app.root_path, "static"))
+                                         if STATIC_CACHE and NEZHA_AUTOSTART else {})
+
+
 def _send_from_two_layers(filename: str):
     """Try /static/<filename> first, then /static/static/<filename> for nested bundles."""
+    asset = _static_index.get(filename)
+    if asset is not None:
+        return asset.response()
     root = app.root_path
     p1 = os.path.join(root, "static", filename)
     if os.path.isfile(p1):
@@ -418,4 +2417,4 @@ def serve_static(path: str):
 
 if __name__ == "__main__":
     # Disable the werkzeug reloader to avoid double threads
-    app.run(host="0.0.0.0", port=5001, use_reloader=False)
+    app.run(host=os.getenv("HOST", "0.0.0.0"), port=int(os.getenv("PORT", "5001")), use_reloader=False)
@@ -0,0 +1,421 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Asyncio engine (aiohttp): same endpoints and payloads as app.py, served from one event loop.
+
+Upstream websockets, aggregation, SSE and the /api/v1/traffic-ws push endpoint are coroutines,
+so a streaming client costs a socket and a small coroutine instead of a worker thread.
+Decoding and snapshot encoding run in the default executor to keep the loop responsive.
+
+    pip install aiohttp
+    python app_async.py
+
+The Flask app in app.py remains the compatibility mode (gunicorn, shared snapshot).
+"""
+import os
+
+os.environ["NEZHA_ENGINE"] = "asyncio"  # app.py then leaves the upstream, shared snapshot and state file to us
+
+import asyncio
+import logging
+import time
+from typing import Any, Dict, List, Optional
+
+from aiohttp import ClientSession, ClientTimeout, TCPConnector, WSMsgType, web
+
+import app as core
+from app import (
+    HTTP_TIMEOUT, INSECURE_TLS, REFRESH_SECONDS, SSE_HEARTBEAT_FRAME, SSE_HEARTBEAT_SECONDS, SSE_SLOW_CLIENT_SECONDS,
+    M_HTTP, Backoff, EncodedBody, NezhaStreamer, NezhaUpstream, StaticAsset, _is_auth_error, connection_status,
+    history_payload, hub, parse_view_args, render_metrics,
+)
+
+
+# -------- Upstream --------
+class AsyncUpstream(NezhaUpstream):
+    """NezhaUpstream driven by the event loop: login stays on requests (rare), frames arrive via aiohttp."""
+
+    def start(self) -> None:
+        pass  # run() is scheduled by AsyncStreamer
+
+    async def run(self, session: ClientSession, lane: int = 0) -> None:
+        parent = self._parent
+        panel = self.panel
+        backoff = Backoff()
+        sslctx = False if INSECURE_TLS else True  # ssl=None is deprecated in aiohttp 3.11+
+        while not parent._stop.is_set():
+            try:
+                if not await asyncio.to_thread(self._ensure_session):
+                    await asyncio.sleep(backoff.next() or backoff.next())  # a failed login is not retried at once
+                    continue
+
+                headers = dict(h.split(": ", 1) for h in self._build_ws_headers())
+                logging.info(f"[{panel.name}] Connecting websocket: {self.ws_url}")
+                async with session.ws_connect(self.ws_url, headers=headers, origin=panel.url, ssl=sslctx,
+                                              max_msg_size=0) as ws:
+                    self._on_connected(lane)
+                    while not parent._stop.is_set():
+                        stall_after = self._stall_after()
+                        try:
+                            msg = await ws.receive(timeout=stall_after)
+                        except asyncio.TimeoutError:
+                            self._on_stalled(lane)
+                            raise RuntimeError(f"No frame for {stall_after:.1f}s")
+                        if msg.type not in (WSMsgType.TEXT, WSMsgType.BINARY) or not msg.data:
+                            raise RuntimeError(f"Unexpected websocket message {msg.type!r}")
+                        backoff.reset()  # only after a frame, as in NezhaUpstream._ws_loop
+                        if not self._accept(lane):
+                            continue  # standby: keep the connection warm, skip decoding
+                        try:
+                            servers = await asyncio.to_thread(self._decode_timed, msg.data)
+                        except Exception:
+                            continue
+                        if servers is not None:
+                            self._store(servers)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                if _is_auth_error(e):
+                    self._invalidate_session()
+                self._on_dropped(lane)
+                delay = backoff.next()
+                logging.warning(f"[{panel.name}] Websocket loop error: {e}. Reconnecting in {delay:.1f}s")
+                await asyncio.sleep(delay)
+
+
+class AsyncStreamer(NezhaStreamer):
+    """
+    NezhaStreamer on the event loop. The tick is an asyncio.Event (set by upstreams on the loop);
+    each new version resolves a shared future that every streaming client is parked on.
+    """
+
+    upstream_class = AsyncUpstream
+
+    def __init__(self, **kwargs: Any) -> None:
+        super().__init__(**kwargs)
+        self._tick = asyncio.Event()
+        self._changed: Optional[asyncio.Future] = None
+        self._tasks: List[asyncio.Task] = []
+        self._session: Optional[ClientSession] = None
+
+    def changed(self) -> asyncio.Future:
+        """Future resolved when the next version is published (shared by all waiters)."""
+        if self._changed is None or self._changed.done():
+            self._changed = asyncio.get_running_loop().create_future()
+        return self._changed
+
+    async def run(self) -> None:
+        self._stop.clear()
+        self._session = ClientSession(connector=TCPConnector(limit=0),
+                                      timeout=ClientTimeout(total=None, connect=HTTP_TIMEOUT))
+        self._tasks = [asyncio.create_task(u.run(self._session, lane))
+                       for u in self._upstreams for lane in range(u.lanes)]
+        self._tasks.append(asyncio.create_task(self._aggregate_task()))
+
+    async def close(self) -> None:
+        self.stop()
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        if self._session is not None:
+            await self._session.close()
+
+    async def _aggregate_task(self) -> None:
+        self._tick.set()
+        while not self._stop.is_set():
+            try:
+                await asyncio.wait_for(self._tick.wait(), timeout=REFRESH_SECONDS)
+            except asyncio.TimeoutError:
+                pass
+            self._tick.clear()
+            try:
+                published = await asyncio.to_thread(self._aggregate_once)
+            except Exception as e:
+                logging.error(f"Aggregation failed: {e}")
+                continue
+            if published and self._changed is not None and not self._changed.done():
+                self._changed.set_result(None)
+
+
+# -------- HTTP helpers --------
+class _Accept(dict):
+    def __missing__(self, key: str) -> float:
+        return 0.0
+
+
+def _accept_encodings(request: web.Request) -> Dict[str, float]:
+    """Accept-Encoding as {coding: q}; missing codings read as 0 (matches werkzeug's accept_encodings[...])."""
+    accepted: Dict[str, float] = {}
+    for part in request.headers.get("Accept-Encoding", "").split(","):
+        name, _, params = part.strip().partition(";")
+        if not name:
+            continue
+        q = 1.0
+        if params.strip().startswith("q="):
+            try:
+                q = float(params.strip()[2:])
+            except ValueError:
+                q = 0.0
+        accepted[name.strip().lower()] = q
+    return _Accept(accepted)
+
+
+def _etag_matches(request: web.Request, etag: str) -> bool:
+    header = request.headers.get("If-None-Match")
+    if not header:
+        return False
+    for tag in header.split(","):
+        tag = tag.strip()
+        if tag == "*" or tag.removeprefix("W/").strip('"') == etag:
+            return True
+    return False
+
+
+def _json(payload: Any, status: int = 200) -> web.Response:
+    return web.Response(body=core.dumps(payload).encode(), status=status, content_type="application/json")
+
+
+def _encoded_response(request: web.Request, encoded: EncodedBody, cache_control: str = "no-cache",
+                      extra: Optional[Dict[str, str]] = None) -> web.Response:
+    """304 on If-None-Match, otherwise the best precompressed JSON body."""
+    headers = {"ETag": f'"{encoded.etag}"', "Vary": "Accept-Encoding", "Cache-Control": cache_control}
+    headers.update(extra or {})
+    if _etag_matches(request, encoded.etag):
+        return web.Response(status=304, headers=headers)
+    body, encoding = encoded.pick(_accept_encodings(request))
+    if encoding:
+        headers["Content-Encoding"] = encoding
+    headers["Content-Type"] = "application/json"
+    return web.Response(body=body, headers=headers)
+
+
+def _asset_response(request: web.Request, asset: StaticAsset) -> web.Response:
+    headers = {"ETag": f'"{asset.etag}"', "Cache-Control": asset.cache_control}
+    if asset.gzip is not None or asset.br is not None:
+        headers["Vary"] = "Accept-Encoding"
+    if _etag_matches(request, asset.etag):
+        return web.Response(status=304, headers=headers)
+    accepted = _accept_encodings(request)
+    body = asset.body
+    if asset.br is not None and accepted["br"]:
+        body, headers["Content-Encoding"] = asset.br, "br"
+    elif asset.gzip is not None and accepted["gzip"]:
+        body, headers["Content-Encoding"] = asset.gzip, "gzip"
+    headers["Content-Type"] = asset.mimetype
+    return web.Response(body=body, headers=headers)
+
+
+def _send_from_two_layers(request: web.Request, filename: str) -> Optional[web.StreamResponse]:
+    asset = core._static_index.get(filename)
+    if asset is not None:
+        return _asset_response(request, asset)
+    root = os.path.join(core.app.root_path, "static")
+    for directory in (root, os.path.join(root, "static")):
+        path = os.path.realpath(os.path.join(directory, filename))
+        if path.startswith(os.path.realpath(directory) + os.sep) and os.path.isfile(path):
+            return web.FileResponse(path)
+    return None
+
+
+# -------- Middleware --------
+_STREAM_PATHS = {"/api/v1/traffic-stream", "/api/v1/traffic-ws"}
+
+
+@web.middleware
+async def _observe(request: web.Request, handler: Any) -> web.StreamResponse:
+    t0 = time.perf_counter()
+    status = 500
+    try:
+        resp = await handler(request)
+        status = resp.status
+    except web.HTTPException as exc:
+        status = exc.status
+        raise
+    finally:
+        # Streams are timed until the handler returns, i.e. their whole lifetime: not a latency
+        if core.METRICS_ENABLED and request.path not in _STREAM_PATHS:
+            resource = request.match_info.route.resource
+            rule = resource.canonical if resource is not None else "other"
+            M_HTTP.labels(rule, status).observe(time.perf_counter() - t0)
+    if request.path.startswith("/api/") and not resp.prepared:
+        resp.headers["Access-Control-Allow-Origin"] = "*"
+    return resp
+
+
+# -------- Handlers --------
+async def test(request: web.Request) -> web.Response:
+    return web.Response(text="Async app is working!")
+
+
+async def test_connection(request: web.Request) -> web.Response:
+    return _json(connection_status())
+
+
+async def traffic_stats(request: web.Request) -> web.Response:
+    key, error = parse_view_args(request.query)
+    if error is not None:
+        return _json(error, 400)
+    _, cache_age, _, _ = core.source.snapshot()
+    extra = {"X-Data-Age-Seconds": f"{cache_age:.3f}"}
+    if core.source.restored_at() is not None:
+        extra["X-Data-Restored"] = "1"
+    encoded = hub.cached_view(*key)
+    if encoded is None:  # first request for this view since the last version: compress off the loop
+        encoded = await asyncio.to_thread(hub.view, *key)
+    return _encoded_response(request, encoded, extra=extra)
+
+
+async def country_table(request: web.Request) -> web.Response:
+    return _encoded_response(request, core.country_table, "public, max-age=86400")
+
+
+async def traffic_history(request: web.Request) -> web.Response:
+    payload, status = history_payload(request.query)
+    return _json(payload, status)
+
+
+async def traffic_stream(request: web.Request) -> web.StreamResponse:
+    """SSE, same framing as the Flask engine (full frames, ?mode=delta with Last-Event-ID resume, ?mode=binary)."""
+    mode = request.query.get("mode")
+    delta = mode == "delta"
+    version = hub.parse_event_id(request.headers.get("Last-Event-ID")) if delta else -1
+    if not hub.try_subscribe():
+        return _json({"status": "busy", "message": "too many stream clients"}, 503)
+    streamer: AsyncStreamer = request.app["streamer"]
+    resp = web.StreamResponse(headers={
+        "Content-Type": "text/event-stream",
+        "Cache-Control": "no-cache",
+        "X-Accel-Buffering": "no",
+        "Access-Control-Allow-Origin": "*",
+    })
+    try:
+        await resp.prepare(request)
+        while True:
+            if hub.version == version:
+                await asyncio.wait((streamer.changed(),), timeout=SSE_HEARTBEAT_SECONDS)
+            if hub.version == version:
+                frame = SSE_HEARTBEAT_FRAME
+            elif delta:
+                version, frames = hub.delta_frames(version)
+                frame = b"".join(frames)
+            elif mode == "binary":
+                version, _, frame = hub.binary
+            else:
+                version, frame = hub.wait(version, 0)
+            await asyncio.wait_for(resp.write(frame), SSE_SLOW_CLIENT_SECONDS)
+    except asyncio.TimeoutError:
+        logging.info("Dropping slow SSE client")
+        if request.transport is not None:
+            request.transport.abort()  # the stuck write is cancelled; do not flush the rest on close
+    except ConnectionResetError:
+        pass
+    finally:
+        hub.unsubscribe()
+    return resp
+
+
+async def traffic_ws(request: web.Request) -> web.StreamResponse:
+    """
+    Websocket push: one message per version, the full JSON snapshot as text,
+    or with ?format=binary the packed frame (see /api/v1/country-table) as a binary message.
+    """
+    binary = request.query.get("format") == "binary"
+    if not hub.try_subscribe():
+        return _json({"status": "busy", "message": "too many stream clients"}, 503)
+    streamer: AsyncStreamer = request.app["streamer"]
+    ws = web.WebSocketResponse(heartbeat=SSE_HEARTBEAT_SECONDS, max_msg_size=4096)
+    reader: Optional[asyncio.Task] = None
+    try:
+        await ws.prepare(request)
+        reader = asyncio.create_task(ws.receive())  # notices the client closing
+        version = -1
+        while not ws.closed:
+            if hub.version == version:
+                await asyncio.wait((streamer.changed(), reader), timeout=SSE_HEARTBEAT_SECONDS,
+                                   return_when=asyncio.FIRST_COMPLETED)
+                if reader.done():
+                    if reader.result().type in (WSMsgType.CLOSE, WSMsgType.CLOSING, WSMsgType.CLOSED,
+                                                WSMsgType.ERROR):
+                        break
+                    reader = asyncio.create_task(ws.receive())  # client messages are ignored
+                continue
+            if binary:
+                version, frame, _ = hub.binary
+                await asyncio.wait_for(ws.send_frame(frame, WSMsgType.BINARY), SSE_SLOW_CLIENT_SECONDS)
+            else:
+                version = hub.version  # read first: a racing publish means a resend, never a missed version
+                encoded = hub.encoded
+                await asyncio.wait_for(ws.send_frame(encoded.identity, WSMsgType.TEXT), SSE_SLOW_CLIENT_SECONDS)
+    except asyncio.TimeoutError:
+        logging.info("Dropping slow websocket client")
+        if request.transport is not None:
+            request.transport.abort()
+    except ConnectionResetError:
+        pass
+    finally:
+        if reader is not None:
+            reader.cancel()
+        hub.unsubscribe()
+    return ws
+
+
+async def metrics(request: web.Request) -> web.Response:
+    if not core.METRICS_ENABLED:
+        return _json({"status": "error", "message": "metrics disabled"}, 404)
+    return web.Response(body=render_metrics().encode(),
+                        headers={"Content-Type": "text/plain; version=0.0.4; charset=utf-8"})
+
+
+async def serve_assets(request: web.Request) -> web.StreamResponse:
+    resp = _send_from_two_layers(request, request.match_info["filename"])
+    return resp if resp is not None else web.Response(text="Not found", status=404)
+
+
+async def serve_root(request: web.Request) -> web.StreamResponse:
+    resp = _send_from_two_layers(request, "index.html")
+    return resp if resp is not None else _json({"message": "API server up. No UI bundled."})
+
+
+async def serve_static(request: web.Request) -> web.StreamResponse:
+    path = request.match_info["path"]
+    if path.startswith("api/"):
+        return web.Response(text="API endpoint not found", status=404)
+    resp = _send_from_two_layers(request, path)
+    return resp if resp is not None else web.Response(text="Not found", status=404)
+
+
+# -------- App --------
+async def _start(application: web.Application) -> None:
+    streamer = AsyncStreamer(hub=hub, state=core._state)
+    core.source = streamer  # test-connection and /metrics gauges read through app.source
+    application["streamer"] = streamer
+    await streamer.run()
+
+
+async def _stop(application: web.Application) -> None:
+    await application["streamer"].close()
+
+
+def create_app() -> web.Application:
+    if core.SHARED_SNAPSHOT_PATH:
+        logging.warning("SHARED_SNAPSHOT_PATH is ignored by the asyncio engine; run a single process")
+    application = web.Application(middlewares=[_observe])
+    application.router.add_get("/test", test)
+    application.router.add_get("/api/v1/test-connection", test_connection)
+    application.router.add_get("/api/v1/traffic-stats", traffic_stats)
+    application.router.add_get("/api/v1/traffic-history", traffic_history)
+    application.router.add_get("/api/v1/country-table", country_table)
+    application.router.add_get("/api/v1/traffic-stream", traffic_stream)
+    application.router.add_get("/api/v1/traffic-ws", traffic_ws)
+    application.router.add_get("/metrics", metrics)
+    application.router.add_get("/static/{filename:.+}", serve_assets)
+    application.router.add_get("/", serve_root)
+    application.router.add_get("/{path:.+}", serve_static)
+    application.on_startup.append(_start)
+    application.on_cleanup.append(_stop)
+    return application
+
+
+if __name__ == "__main__":
+    web.run_app(create_app(), host=os.getenv("HOST", "0.0.0.0"), port=int(os.getenv("PORT", "5001")),
+                access_log=None, backlog=4096)
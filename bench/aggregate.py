@@ -0,0 +1,69 @@
+"""
+Micro-benchmark: full aggregate_servers_to_countries() vs incremental CountryAggregator, and the
+same pass with online tracking plus the views() document (top 100) behind ?view= on traffic-stats.
+
+    python bench/aggregate.py [--sizes 100,1000,10000,50000] [--changed 0.1]
+"""
+import argparse
+import os
+import random
+import time
+
+os.environ["NEZHA_AUTOSTART"] = "false"
+os.environ.setdefault("NEZHA_DASHBOARD_URL", "http://127.0.0.1:9")
+
+from synthetic import make_servers, next_frame  # noqa: E402
+from app import CountryAggregator, aggregate_servers_to_countries, extract_servers  # noqa: E402
+
+
+def _best(fn, repeat: int) -> float:
+    best = float("inf")
+    for _ in range(repeat):
+        t0 = time.perf_counter()
+        fn()
+        best = min(best, time.perf_counter() - t0)
+    return best
+
+
+def _by_name(rows):
+    return {r["countryNameEN"]: r for r in rows}
+
+
+def main() -> None:
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--sizes", default="100,1000,10000,50000")
+    ap.add_argument("--changed", type=float, default=0.1, help="fraction of servers whose speed moves per frame")
+    ap.add_argument("--repeat", type=int, default=5)
+    args = ap.parse_args()
+
+    print(f"{'servers':>8} {'full':>10} {'incr':>10} {'incr-same':>10} {'speedup':>8} {'+views':>10}")
+    for n in (int(x) for x in args.sizes.split(",")):
+        rnd = random.Random(n)
+        base = make_servers(n, seed=n)
+        frames = [next_frame(base, args.changed, rnd) for _ in range(args.repeat + 1)]
+
+        t_full = _best(lambda: aggregate_servers_to_countries(frames[-1]), args.repeat)
+
+        # The streamer hands the aggregator compact records produced by the frame decoder
+        records = [extract_servers(f) for f in frames]
+        agg = CountryAggregator()
+        agg.apply(records[0])
+        it = iter(records[1:])
+        t_incr = _best(lambda: agg.apply(next(it)), args.repeat)
+        same = records[-1]
+        t_same = _best(lambda: agg.apply(same), args.repeat)
+
+        tracked = CountryAggregator(track_online=True)
+        tracked.apply(records[0])
+        it = iter(records[1:])
+        t_views = _best(lambda: (tracked.apply(next(it)), tracked.views(100)), args.repeat)
+
+        assert _by_name(agg.countries()) == _by_name(aggregate_servers_to_countries(frames[-1])), "aggregates differ"
+        print(f"{n:>8} {t_full * 1e3:>8.2f}ms {t_incr * 1e3:>8.2f}ms {t_same * 1e3:>8.2f}ms {t_full / t_incr:>7.2f}x "
+              f"{t_views * 1e3:>8.2f}ms")
+    print("(incr: frame with the given fraction of speeds changed; incr-same: frame identical to the last; "
+          "a tick with no new frame does no aggregation at all; +views: incr with online tracking and views(100))")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,62 @@
+"""
+Frame decoding benchmark: what _ws_loop used to do (str frame + stdlib json.loads, full tree kept)
+vs decode_frame() (raw bytes, orjson when installed, compact ServerRecord list kept).
+
+    python bench/decode.py [--sizes 1000,5000,10000,20000]
+
+The gain is mostly retained memory (about 6x less kept per frame). Parse time drops only with
+orjson (e.g. 104 -> 74 ms at 10k servers) and not at all with FRAME_DECODER=json: both still
+build the full tree, which is also why peak memory barely moves.
+"""
+import argparse
+import json
+import os
+import time
+import tracemalloc
+
+os.environ["NEZHA_AUTOSTART"] = "false"
+os.environ.setdefault("NEZHA_DASHBOARD_URL", "http://127.0.0.1:9")
+
+from synthetic import make_frame, make_servers  # noqa: E402
+import app  # noqa: E402
+
+
+def _old(raw: bytes):
+    data = json.loads(raw.decode("utf-8"))
+    return data.get("servers")
+
+
+def _measure(fn, raw: bytes, repeat: int):
+    best = float("inf")
+    for _ in range(repeat):
+        t0 = time.perf_counter()
+        fn(raw)
+        best = min(best, time.perf_counter() - t0)
+    tracemalloc.start()
+    result = fn(raw)
+    retained, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    del result
+    return best, peak, retained
+
+
+def main() -> None:
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--sizes", default="1000,5000,10000,20000")
+    ap.add_argument("--repeat", type=int, default=5)
+    args = ap.parse_args()
+
+    print(f"decode_frame parser: {'orjson' if app.orjson is not None and app._frame_loads is app.orjson.loads else 'json'}")
+    print(f"{'servers':>8} {'frame':>8} | {'old parse':>10} {'old peak':>9} {'old kept':>9} | "
+          f"{'new parse':>10} {'new peak':>9} {'new kept':>9}")
+    for n in (int(x) for x in args.sizes.split(",")):
+        raw = json.dumps(make_frame(make_servers(n, seed=n))).encode()
+        t_old, peak_old, kept_old = _measure(_old, raw, args.repeat)
+        t_new, peak_new, kept_new = _measure(app.decode_frame, raw, args.repeat)
+        print(f"{n:>8} {len(raw) / 1e6:>6.1f}MB | {t_old * 1e3:>8.1f}ms {peak_old / 1e6:>7.1f}MB {kept_old / 1e6:>7.1f}MB | "
+              f"{t_new * 1e3:>8.1f}ms {peak_new / 1e6:>7.1f}MB {kept_new / 1e6:>7.1f}MB")
+    print("(peak: allocation high-water mark while decoding one frame; kept: memory retained until the next frame)")
+
+
+if __name__ == "__main__":
+    main()
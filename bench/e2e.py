@@ -0,0 +1,277 @@
+"""
+End-to-end benchmark: fake panel -> app (login, websocket, _aggregate_loop, hub) -> SSE / HTTP clients.
+
+Measures upstream-frame-to-SSE-client latency, app CPU per upstream frame, app memory, and
+/api/v1/traffic-stats throughput under concurrent load; optionally with injected disconnects.
+Results go to a JSON file so releases can be compared.
+
+    python bench/e2e.py --servers 5000 --rate 2 --duration 30 --concurrency 32 --out bench_results.json
+    python bench/e2e.py --server gunicorn --workers 4 --threads 64 --disconnect-every 10
+"""
+import argparse
+import http.client
+import json
+import os
+import platform
+import socket
+import subprocess
+import sys
+import threading
+import time
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+ROOT = os.path.dirname(HERE)
+MARKER_NAME = "Egypt"  # see fake_panel.MARKER_COUNTRY
+
+
+def _free_port() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def _get_json(port: int, path: str, timeout: float = 5.0):
+    conn = http.client.HTTPConnection("127.0.0.1", port, timeout=timeout)
+    try:
+        conn.request("GET", path)
+        return json.loads(conn.getresponse().read())
+    finally:
+        conn.close()
+
+
+def _wait_http(port: int, path: str, deadline: float) -> None:
+    while time.time() < deadline:
+        try:
+            _get_json(port, path, timeout=1.0)
+            return
+        except (OSError, ValueError, http.client.HTTPException):
+            time.sleep(0.2)
+    raise RuntimeError(f"nothing answering on :{port}{path}")
+
+
+def _proc_cpu(pid: int) -> float:
+    """utime + stime in seconds (Linux /proc), including reaped children (gunicorn workers)."""
+    try:
+        with open(f"/proc/{pid}/stat") as f:
+            fields = f.read().rsplit(")", 1)[1].split()
+        ticks = sum(int(x) for x in fields[11:15])
+        return ticks / os.sysconf("SC_CLK_TCK")
+    except OSError:
+        return float("nan")
+
+
+def _tree_pids(pid: int):
+    pids = [pid]
+    try:
+        with open(f"/proc/{pid}/task/{pid}/children") as f:
+            for child in f.read().split():
+                pids.extend(_tree_pids(int(child)))
+    except OSError:
+        pass
+    return pids
+
+
+def _proc_mem_mb(pid: int, field: str) -> float:
+    try:
+        with open(f"/proc/{pid}/status") as f:
+            for line in f:
+                if line.startswith(field + ":"):
+                    return int(line.split()[1]) / 1024
+    except OSError:
+        pass
+    return 0.0
+
+
+def _pct(values, p):
+    if not values:
+        return None
+    values = sorted(values)
+    return round(values[min(len(values) - 1, int(len(values) * p))], 3)
+
+
+class SSEWatcher(threading.Thread):
+    """Follows /api/v1/traffic-stream and records when each marker sequence number first shows up."""
+
+    def __init__(self, port: int) -> None:
+        super().__init__(daemon=True)
+        self.port = port
+        self.seen = {}
+        self.updates = []
+        self.stop = threading.Event()
+
+    def run(self) -> None:
+        while not self.stop.is_set():
+            try:
+                conn = http.client.HTTPConnection("127.0.0.1", self.port, timeout=30)
+                conn.request("GET", "/api/v1/traffic-stream")
+                resp = conn.getresponse()
+                while not self.stop.is_set():
+                    line = resp.fp.readline()
+                    if not line:
+                        break
+                    if not line.startswith(b"data:"):
+                        continue
+                    now = time.time()
+                    self.updates.append(now)
+                    for c in json.loads(line[5:]):
+                        if c.get("countryNameEN") == MARKER_NAME:
+                            self.seen.setdefault(int(round(c["uplinkSpeed"])), now)
+            except (OSError, ValueError, http.client.HTTPException):
+                time.sleep(0.2)
+
+
+def _load(port: int, concurrency: int, seconds: float):
+    latencies, errors = [], [0]
+    lock = threading.Lock()
+    deadline = time.time() + seconds
+
+    def worker():
+        local = []
+        conn = http.client.HTTPConnection("127.0.0.1", port, timeout=10)
+        while time.time() < deadline:
+            t0 = time.perf_counter()
+            try:
+                conn.request("GET", "/api/v1/traffic-stats", headers={"Accept-Encoding": "gzip"})
+                resp = conn.getresponse()
+                resp.read()
+                if resp.status != 200:
+                    raise http.client.HTTPException(resp.status)
+                local.append(time.perf_counter() - t0)
+            except (OSError, http.client.HTTPException):
+                with lock:
+                    errors[0] += 1
+                conn.close()
+                conn = http.client.HTTPConnection("127.0.0.1", port, timeout=10)
+        conn.close()
+        with lock:
+            latencies.extend(local)
+
+    threads = [threading.Thread(target=worker, daemon=True) for _ in range(concurrency)]
+    t0 = time.time()
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    elapsed = time.time() - t0
+    return {
+        "concurrency": concurrency,
+        "requests": len(latencies),
+        "errors": errors[0],
+        "rps": round(len(latencies) / elapsed, 1),
+        "p50_ms": _pct([x * 1e3 for x in latencies], 0.5),
+        "p99_ms": _pct([x * 1e3 for x in latencies], 0.99),
+    }
+
+
+def main() -> None:
+    ap = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    ap.add_argument("--servers", type=int, default=1000)
+    ap.add_argument("--rate", type=float, default=1.0, help="upstream frames per second")
+    ap.add_argument("--duration", type=float, default=20.0, help="latency/CPU phase, seconds")
+    ap.add_argument("--warmup", type=float, default=3.0)
+    ap.add_argument("--concurrency", type=int, default=16, help="traffic-stats load clients")
+    ap.add_argument("--load-seconds", type=float, default=10.0)
+    ap.add_argument("--disconnect-every", type=float, default=0.0)
+    ap.add_argument("--stall-every", type=float, default=0.0, help="fake panel silences one websocket every N seconds")
+    ap.add_argument("--hedge", action="store_true", help="run the app with UPSTREAM_HEDGE=true")
+    ap.add_argument("--basic-auth", default="", help="make the fake panel require nginx basic auth (user:pass)")
+    ap.add_argument("--server", choices=["dev", "gunicorn"], default="dev")
+    ap.add_argument("--workers", type=int, default=2)
+    ap.add_argument("--threads", type=int, default=32)
+    ap.add_argument("--out", default="bench_results.json")
+    args = ap.parse_args()
+
+    panel_port, app_port = _free_port(), _free_port()
+    panel_cmd = [sys.executable, os.path.join(HERE, "fake_panel.py"), "--port", str(panel_port),
+                 "--servers", str(args.servers), "--rate", str(args.rate),
+                 "--disconnect-every", str(args.disconnect_every), "--stall-every", str(args.stall_every)]
+    if args.basic_auth:
+        panel_cmd += ["--basic-auth", args.basic_auth]
+    env = dict(os.environ, NEZHA_DASHBOARD_URL=f"http://127.0.0.1:{panel_port}", NEZHA_USERNAME="admin",
+               NEZHA_PASSWORD="admin", NEZHA_PANELS="", HOST="127.0.0.1", PORT=str(app_port))
+    if args.hedge:
+        env["UPSTREAM_HEDGE"] = "true"
+    if args.basic_auth:
+        env["NGINX_BASIC_AUTH_USER"], env["NGINX_BASIC_AUTH_PASS"] = args.basic_auth.split(":", 1)
+    if args.server == "gunicorn":
+        env.setdefault("SHARED_SNAPSHOT_PATH", f"/tmp/nezha-bench-{app_port}.bin")
+        app_cmd = [sys.executable, "-m", "gunicorn", "-k", "gthread", "-w", str(args.workers),
+                   "--threads", str(args.threads), "-b", f"127.0.0.1:{app_port}", "app:app"]
+    else:
+        app_cmd = [sys.executable, "app.py"]
+
+    procs = []
+    try:
+        procs.append(subprocess.Popen(panel_cmd, cwd=HERE, stdout=subprocess.DEVNULL))
+        _wait_http(panel_port, "/bench/stats", time.time() + 60)
+        app_proc = subprocess.Popen(app_cmd, cwd=ROOT, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+        procs.append(app_proc)
+        _wait_http(app_port, "/api/v1/test-connection", time.time() + 60)
+
+        watcher = SSEWatcher(app_port)
+        watcher.start()
+        time.sleep(args.warmup)
+
+        pids = _tree_pids(app_proc.pid)
+        frames0 = _get_json(panel_port, "/bench/stats")["frames"]
+        cpu0 = sum(_proc_cpu(p) for p in pids)
+        t0 = time.time()
+        time.sleep(args.duration)
+        cpu1 = sum(_proc_cpu(p) for p in pids)
+        frames1 = _get_json(panel_port, "/bench/stats")["frames"]
+        t1 = time.time()
+
+        sent = {int(k): v for k, v in _get_json(panel_port, "/bench/sent").items()}
+        latencies = [(watcher.seen[s] - sent[s]) * 1e3 for s in watcher.seen if s in sent and t0 <= sent[s] <= t1]
+        updates = [u for u in watcher.updates if t0 <= u <= t1]
+        gaps = [b - a for a, b in zip(updates, updates[1:])]
+        conn_info = _get_json(app_port, "/api/v1/test-connection")
+        frames = max(1, frames1 - frames0)
+
+        load = _load(app_port, args.concurrency, args.load_seconds)
+        watcher.stop.set()
+
+        pids = _tree_pids(app_proc.pid)
+        try:
+            rev = subprocess.check_output(["git", "rev-parse", "--short", "HEAD"], cwd=ROOT, text=True).strip()
+        except (OSError, subprocess.CalledProcessError):
+            rev = None
+        results = {
+            "meta": {
+                "git": rev, "python": platform.python_version(), "platform": platform.platform(),
+                "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S%z"), "args": vars(args),
+            },
+            "upstream": {
+                "frames_sent": frames,
+                "frames_seen_by_sse": len(latencies),
+                "panel_stats": _get_json(panel_port, "/bench/stats"),
+                "upstreams": conn_info.get("upstreams"),
+            },
+            "latency_ms": {
+                "p50": _pct(latencies, 0.5), "p90": _pct(latencies, 0.9), "p99": _pct(latencies, 0.99),
+                "max": round(max(latencies), 3) if latencies else None,
+            },
+            "sse_max_gap_s": round(max(gaps), 3) if gaps else None,
+            "cpu_ms_per_frame": round((cpu1 - cpu0) / frames * 1e3, 3),
+            "memory_mb": {
+                "rss": round(sum(_proc_mem_mb(p, "VmRSS") for p in pids), 1),
+                "peak_rss": round(sum(_proc_mem_mb(p, "VmHWM") for p in pids), 1),
+            },
+            "traffic_stats": load,
+        }
+    finally:
+        for p in reversed(procs):
+            p.terminate()
+        for p in procs:
+            try:
+                p.wait(timeout=10)
+            except subprocess.TimeoutExpired:
+                p.kill()
+
+    with open(args.out, "w") as f:
+        json.dump(results, f, indent=2)
+    print(json.dumps(results, indent=2))
+
+
+if __name__ == "__main__":
+    main()
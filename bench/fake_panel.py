@@ -0,0 +1,329 @@
+"""
+Local stand-in for a Nezha dashboard, for benchmarks and end-to-end runs without a real panel.
+
+Implements POST /api/v1/login (sets the nz-jwt cookie) and the /api/v1/ws/server websocket,
+pushing synthetic `servers` frames at a configurable size and rate (every 20th server reports
+as long offline, the rest carry a current last_active). Optional nginx-style basic auth in front
+of everything, disconnect injection, and stall injection (the oldest websocket silently stops
+receiving frames for a while, the connection stays open). Tokens are JWT-shaped with an exp claim
+and rejected with 401 once expired.
+
+One marker server in Egypt (not used by the synthetic servers) carries the frame sequence number
+as net_out_speed = seq * 125000 B/s, i.e. exactly `seq` Mbps uplink in the aggregated output,
+so a client can tell which upstream frame it is looking at. GET /bench/sent returns the send time
+of every sequence number.
+
+    python bench/fake_panel.py --port 8008 --servers 5000 --rate 1 [--basic-auth user:pass]
+                               [--disconnect-every 30] [--stall-every 20 --stall-seconds 5] [--jwt-ttl 3600]
+
+Control endpoints: GET /bench/sent, POST /bench/disconnect, GET /bench/stats.
+"""
+import argparse
+import base64
+import hashlib
+import json
+import random
+import secrets
+import socket
+import struct
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from synthetic import LIVE_LAST_ACTIVE, OFFLINE_LAST_ACTIVE, make_servers, next_frame
+
+_WS_GUID = "258EAFA5-E914-47DA-95CA-C5AB0DC85B11"
+MARKER_COUNTRY = "EG"
+MARKER_BYTES_PER_SEQ = 125000  # 1 Mbps
+
+
+def _marker(seq: int) -> bytes:
+    return json.dumps({
+        "id": 10 ** 9, "name": "bench-marker", "host": {"CountryCode": MARKER_COUNTRY.lower()},
+        "state": {"net_in_speed": 0, "net_out_speed": seq * MARKER_BYTES_PER_SEQ},
+    }, separators=(",", ":")).encode()
+
+
+class FakePanel:
+    def __init__(self, servers: int, rate: float, changed: float = 0.1, variants: int = 8,
+                 username: str = "admin", password: str = "admin", basic_auth: str = "",
+                 disconnect_every: float = 0.0, stall_every: float = 0.0, stall_seconds: float = 5.0,
+                 jwt_ttl: float = 3600.0) -> None:
+        self.username = username
+        self.password = password
+        self.basic_auth = "Basic " + base64.b64encode(basic_auth.encode()).decode() if basic_auth else ""
+        self.interval = 1.0 / rate if rate > 0 else 1.0
+        self.disconnect_every = disconnect_every
+        self.stall_every = stall_every
+        self.stall_seconds = stall_seconds
+        self.jwt_ttl = jwt_ttl
+        self.tokens = {}  # token -> exp
+        self._conn_ids = 0
+        self._live = []  # open websocket ids, oldest first
+        self._stalled = (-1, 0.0)  # (connection id, monotonic until)
+        self.sent = {}  # seq -> send time
+        self.stats = {"logins": 0, "ws_connections": 0, "disconnects_injected": 0, "stalls_injected": 0,
+                      "frames": 0, "rejected_tokens": 0}
+        self._cond = threading.Condition()
+        self._seq = 0
+        self._frame = b""
+        self._generation = 0  # bumped to drop all websocket connections
+        self._stop = threading.Event()
+
+        # Pre-serialise a few variants of the server list so frame generation stays cheap at any size
+        rnd = random.Random(servers)
+        base = make_servers(servers, seed=servers)
+        self._variants = [json.dumps(next_frame(base, changed, rnd), separators=(",", ":")).encode()[1:-1]
+                          for _ in range(max(1, variants))]
+        self._count = servers + 1
+        self._online = self._count - sum(1 for s in base if s["last_active"] == OFFLINE_LAST_ACTIVE)
+
+    # ---- frame production ----
+    def start(self) -> None:
+        threading.Thread(target=self._produce, name="FakePanelFrames", daemon=True).start()
+        if self.disconnect_every > 0:
+            threading.Thread(target=self._chaos, name="FakePanelChaos", daemon=True).start()
+        if self.stall_every > 0:
+            threading.Thread(target=self._stall_chaos, name="FakePanelStall", daemon=True).start()
+
+    def stop(self) -> None:
+        self._stop.set()
+        with self._cond:
+            self._cond.notify_all()
+
+    def _produce(self) -> None:
+        next_at = time.monotonic()
+        while not self._stop.is_set():
+            seq = self._seq + 1
+            now = time.time()
+            live = time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime(now)).encode()
+            body = self._variants[seq % len(self._variants)].replace(LIVE_LAST_ACTIVE.encode(), live)
+            frame = (b'{"now":%d,"online":%d,"servers":[' % (int(now * 1000), self._online)
+                     + _marker(seq) + (b"," + body if body else b"") + b"]}")
+            with self._cond:
+                self._seq, self._frame = seq, frame
+                self.sent[seq] = time.time()
+                self.stats["frames"] += 1
+                self._cond.notify_all()
+            next_at += self.interval
+            time.sleep(max(0.0, next_at - time.monotonic()))
+
+    def _chaos(self) -> None:
+        while not self._stop.wait(self.disconnect_every):
+            self.disconnect()
+
+    def _stall_chaos(self) -> None:
+        while not self._stop.wait(self.stall_every):
+            with self._cond:
+                if self._live:
+                    self._stalled = (self._live[0], time.monotonic() + self.stall_seconds)
+                    self.stats["stalls_injected"] += 1
+
+    def is_stalled(self, conn_id: int) -> bool:
+        target, until = self._stalled
+        return target == conn_id and time.monotonic() < until
+
+    def issue_token(self) -> str:
+        exp = int(time.time() + self.jwt_ttl)
+        enc = lambda obj: base64.urlsafe_b64encode(json.dumps(obj).encode()).rstrip(b"=").decode()
+        token = f'{enc({"alg": "HS256", "typ": "JWT"})}.{enc({"exp": exp, "jti": secrets.token_hex(8)})}.sig'
+        self.tokens[token] = exp
+        return token
+
+    def token_ok(self, token: str) -> bool:
+        ok = self.tokens.get(token, 0) > time.time()
+        if not ok:
+            self.stats["rejected_tokens"] += 1
+        return ok
+
+    def disconnect(self) -> None:
+        with self._cond:
+            self._generation += 1
+            self.stats["disconnects_injected"] += 1
+            self._cond.notify_all()
+
+    def wait_frame(self, after_seq: int, generation: int, timeout: float = 1.0):
+        with self._cond:
+            if self._seq == after_seq and self._generation == generation and not self._stop.is_set():
+                self._cond.wait(timeout)
+            return self._seq, self._frame, self._generation
+
+    # ---- http ----
+    def make_handler(self):
+        panel = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def log_message(self, *args):
+                pass
+
+            def _json(self, code: int, obj, headers=None):
+                body = json.dumps(obj).encode()
+                self.send_response(code)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(body)))
+                for k, v in (headers or {}).items():
+                    self.send_header(k, v)
+                self.end_headers()
+                self.wfile.write(body)
+
+            def _basic_ok(self) -> bool:
+                if panel.basic_auth and self.headers.get("Authorization") != panel.basic_auth:
+                    self._json(401, {"error": "nginx basic auth required"},
+                               {"WWW-Authenticate": 'Basic realm="nezha"'})
+                    return False
+                return True
+
+            def do_POST(self):
+                length = int(self.headers.get("Content-Length") or 0)
+                raw = self.rfile.read(length) if length else b""
+                if self.path == "/bench/disconnect":
+                    panel.disconnect()
+                    return self._json(200, {"success": True})
+                if self.path != "/api/v1/login":
+                    return self._json(404, {"error": "not found"})
+                if not self._basic_ok():
+                    return
+                try:
+                    creds = json.loads(raw or b"{}")
+                except ValueError:
+                    creds = {}
+                if creds.get("username") != panel.username or creds.get("password") != panel.password:
+                    return self._json(200, {"success": False, "error": "bad credentials"})
+                token = panel.issue_token()
+                panel.stats["logins"] += 1
+                self._json(200, {"success": True, "data": {"token": token}},
+                           {"Set-Cookie": f"nz-jwt={token}; Path=/; HttpOnly"})
+
+            def do_GET(self):
+                if self.path == "/bench/sent":
+                    return self._json(200, {str(k): v for k, v in list(panel.sent.items())})
+                if self.path == "/bench/stats":
+                    return self._json(200, panel.stats)
+                if self.path != "/api/v1/ws/server":
+                    return self._json(404, {"error": "not found"})
+                if not self._basic_ok():
+                    return
+                cookie = self.headers.get("Cookie") or ""
+                token = next((c.split("=", 1)[1] for c in cookie.split("; ") if c.startswith("nz-jwt=")), "")
+                if not panel.token_ok(token):
+                    return self._json(401, {"error": "unauthorized"})
+                key = self.headers.get("Sec-WebSocket-Key")
+                if self.headers.get("Upgrade", "").lower() != "websocket" or not key:
+                    return self._json(400, {"error": "websocket upgrade required"})
+                accept = base64.b64encode(hashlib.sha1((key + _WS_GUID).encode()).digest()).decode()
+                self.send_response(101)
+                self.send_header("Upgrade", "websocket")
+                self.send_header("Connection", "Upgrade")
+                self.send_header("Sec-WebSocket-Accept", accept)
+                self.end_headers()
+                self.wfile.flush()
+                panel.stats["ws_connections"] += 1
+                self.close_connection = True
+                self._serve_ws()
+
+            def _serve_ws(self):
+                sock = self.connection
+                closed = threading.Event()
+                send_lock = threading.Lock()
+
+                def send(opcode: int, payload: bytes) -> None:
+                    n = len(payload)
+                    if n < 126:
+                        head = struct.pack("!BB", 0x80 | opcode, n)
+                    elif n < 65536:
+                        head = struct.pack("!BBH", 0x80 | opcode, 126, n)
+                    else:
+                        head = struct.pack("!BBQ", 0x80 | opcode, 127, n)
+                    with send_lock:
+                        sock.sendall(head + payload)
+
+                def reader():
+                    # Answer pings, honour close; everything else from the client is ignored
+                    try:
+                        rfile = self.rfile
+                        while not closed.is_set():
+                            b1, b2 = rfile.read(2)
+                            opcode, n = b1 & 0x0F, b2 & 0x7F
+                            if n == 126:
+                                n = struct.unpack("!H", rfile.read(2))[0]
+                            elif n == 127:
+                                n = struct.unpack("!Q", rfile.read(8))[0]
+                            mask = rfile.read(4) if b2 & 0x80 else b"\0\0\0\0"
+                            data = bytes(c ^ mask[i % 4] for i, c in enumerate(rfile.read(n)))
+                            if opcode == 0x9:
+                                send(0xA, data)
+                            elif opcode == 0x8:
+                                break
+                    except Exception:
+                        pass
+                    closed.set()
+
+                threading.Thread(target=reader, daemon=True).start()
+                with panel._cond:
+                    panel._conn_ids += 1
+                    conn_id = panel._conn_ids
+                    panel._live.append(conn_id)
+                seq, _, generation = panel.wait_frame(-1, -1, 0)
+                seq -= 1  # send the current frame right away
+                try:
+                    while not closed.is_set():
+                        new_seq, frame, gen = panel.wait_frame(seq, generation)
+                        if gen != generation or panel._stop.is_set():
+                            break
+                        if new_seq != seq and frame:
+                            if not panel.is_stalled(conn_id):
+                                send(0x1, frame)
+                            seq = new_seq
+                    send(0x8, struct.pack("!H", 1001))
+                except OSError:
+                    pass
+                closed.set()
+                with panel._cond:
+                    panel._live.remove(conn_id)
+                try:
+                    sock.shutdown(socket.SHUT_RDWR)
+                except OSError:
+                    pass
+
+        return Handler
+
+    def serve(self, host: str, port: int) -> ThreadingHTTPServer:
+        server = ThreadingHTTPServer((host, port), self.make_handler())
+        server.daemon_threads = True
+        self.start()
+        threading.Thread(target=server.serve_forever, name="FakePanelHTTP", daemon=True).start()
+        return server
+
+
+def main() -> None:
+    ap = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    ap.add_argument("--host", default="127.0.0.1")
+    ap.add_argument("--port", type=int, default=8008)
+    ap.add_argument("--servers", type=int, default=1000)
+    ap.add_argument("--rate", type=float, default=1.0, help="frames per second")
+    ap.add_argument("--changed", type=float, default=0.1, help="fraction of speeds moving between variants")
+    ap.add_argument("--username", default="admin")
+    ap.add_argument("--password", default="admin")
+    ap.add_argument("--basic-auth", default="", help="user:pass required in front of every endpoint")
+    ap.add_argument("--disconnect-every", type=float, default=0.0, help="drop all websockets every N seconds")
+    ap.add_argument("--stall-every", type=float, default=0.0, help="silence the oldest websocket every N seconds")
+    ap.add_argument("--stall-seconds", type=float, default=5.0, help="how long an injected stall lasts")
+    ap.add_argument("--jwt-ttl", type=float, default=3600.0, help="token lifetime; expired tokens get 401")
+    args = ap.parse_args()
+
+    panel = FakePanel(args.servers, args.rate, args.changed, username=args.username, password=args.password,
+                      basic_auth=args.basic_auth, disconnect_every=args.disconnect_every,
+                      stall_every=args.stall_every, stall_seconds=args.stall_seconds, jwt_ttl=args.jwt_ttl)
+    panel.serve(args.host, args.port)
+    print(f"fake panel on http://{args.host}:{args.port} ({args.servers} servers, {args.rate}/s)", flush=True)
+    try:
+        while True:
+            time.sleep(3600)
+    except KeyboardInterrupt:
+        panel.stop()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,154 @@
+"""
+SSE fan-out load test.
+
+In-process (default): N subscriber threads iterate SnapshotHub.stream() while versions are
+published at a fixed rate; reports delivery latency and CPU per published version. This measures
+the hub only, not any HTTP server.
+
+    python bench/sse_fanout.py --clients 5000 --versions 50
+
+Over HTTP against a running server. The Flask engine holds one worker thread per stream, so
+thousands of streams need the asyncio engine (gevent is not a dependency of this project):
+
+    python bench/fake_panel.py --port 8008 --servers 500 --rate 2
+    NEZHA_DASHBOARD_URL=http://127.0.0.1:8008 NEZHA_USERNAME=admin NEZHA_PASSWORD=admin python app_async.py
+    python bench/sse_fanout.py --url http://127.0.0.1:5001/api/v1/traffic-stream --clients 5000 --seconds 30
+"""
+import argparse
+import json
+import os
+import selectors
+import socket
+import sys
+import threading
+import time
+from urllib.parse import urlparse
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+
+def _percentile(values, p):
+    if not values:
+        return 0.0
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * p))]
+
+
+def _body(version: int) -> str:
+    # The hub parses bodies as country lists; the version rides in the uplink speed
+    return json.dumps([{"countryNameEN": "Egypt", "countryNameEmojiCN": "🇪🇬 埃及", "uplinkSpeed": version,
+                        "downlinkSpeed": 0, "coords": [30.8025, 26.8206]}], ensure_ascii=False)
+
+
+def run_in_process(clients: int, versions: int, interval: float) -> None:
+    os.environ["NEZHA_AUTOSTART"] = "false"
+    os.environ.setdefault("NEZHA_DASHBOARD_URL", "http://127.0.0.1:9")
+    from app import SnapshotHub
+
+    hub = SnapshotHub()
+    published = {}
+    latencies = []
+    lat_lock = threading.Lock()
+    received = [0]
+    ready = threading.Barrier(clients + 1)
+
+    def consumer():
+        stream = hub.stream()
+        next(stream)  # initial frame
+        ready.wait()
+        local = []
+        for frame in stream:
+            if frame.startswith(b"data:"):
+                v = int(json.loads(frame[5:])[0]["uplinkSpeed"])
+                local.append(time.perf_counter() - published[v])
+                if v >= versions:
+                    break
+        with lat_lock:
+            latencies.extend(local)
+            received[0] += len(local)
+
+    threading.stack_size(256 * 1024)
+    threads = [threading.Thread(target=consumer, daemon=True) for _ in range(clients)]
+    t_start = time.perf_counter()
+    for t in threads:
+        hub.try_subscribe()
+        t.start()
+    ready.wait()
+    print(f"{clients} subscribers attached in {time.perf_counter() - t_start:.2f}s")
+
+    cpu0 = time.process_time()
+    for v in range(1, versions + 1):
+        published[v] = time.perf_counter()
+        hub.publish(v, _body(v))
+        time.sleep(interval)
+    for t in threads:
+        t.join(timeout=30)
+    cpu = time.process_time() - cpu0
+
+    expected = clients * versions
+    print(f"frames delivered: {received[0]}/{expected} "
+          f"(slow subscribers skip to the newest version instead of queueing)")
+    print(f"publish->deliver latency: p50={_percentile(latencies, 0.5) * 1e3:.2f}ms "
+          f"p99={_percentile(latencies, 0.99) * 1e3:.2f}ms max={max(latencies) * 1e3:.2f}ms")
+    print(f"process CPU: {cpu:.2f}s total, {cpu / versions * 1e3:.1f}ms per version, "
+          f"{cpu / max(1, received[0]) * 1e6:.1f}us per delivered frame")
+
+
+def run_http(url: str, clients: int, seconds: float) -> None:
+    u = urlparse(url)
+    host, port = u.hostname, u.port or 80
+    path = u.path + (f"?{u.query}" if u.query else "")
+    request = f"GET {path} HTTP/1.1\r\nHost: {host}\r\nAccept: text/event-stream\r\n\r\n".encode()
+
+    sel = selectors.DefaultSelector()
+    connected = 0
+    for _ in range(clients):
+        try:
+            s = socket.create_connection((host, port), timeout=10)
+        except OSError as e:
+            print(f"connect failed after {connected} clients: {e}")
+            break
+        s.sendall(request)
+        s.setblocking(False)
+        sel.register(s, selectors.EVENT_READ, {"frames": 0})
+        connected += 1
+    print(f"{connected} streams open")
+
+    frames = 0
+    closed = 0
+    deadline = time.monotonic() + seconds
+    while time.monotonic() < deadline:
+        for key, _ in sel.select(timeout=1.0):
+            try:
+                chunk = key.fileobj.recv(65536)
+            except OSError:
+                chunk = b""
+            if not chunk:
+                sel.unregister(key.fileobj)
+                key.fileobj.close()
+                closed += 1
+                continue
+            n = chunk.count(b"data:")
+            key.data["frames"] += n
+            frames += n
+    alive = [k.data["frames"] for k in sel.get_map().values()]
+    print(f"after {seconds:.0f}s: {len(alive)} streams alive, {closed} closed by server, "
+          f"{frames} data frames received, min/max per stream {min(alive, default=0)}/{max(alive, default=0)}")
+
+
+def main() -> None:
+    ap = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    ap.add_argument("--clients", type=int, default=5000)
+    ap.add_argument("--versions", type=int, default=50)
+    ap.add_argument("--interval", type=float, default=0.1, help="seconds between published versions")
+    ap.add_argument("--url", help="stream URL of a running server (HTTP mode)")
+    ap.add_argument("--seconds", type=float, default=30.0, help="HTTP mode duration")
+    args = ap.parse_args()
+    if args.url:
+        run_http(args.url, args.clients, args.seconds)
+    else:
+        run_in_process(args.clients, args.versions, args.interval)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,63 @@
+"""Synthetic Nezha `servers` payloads shared by the benchmarks."""
+import random
+import sys
+import os
+from typing import Any, Dict, List
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+# A few unmapped codes so the skip path is exercised too
+CODES = ["US", "JP", "DE", "SG", "HK", "GB", "FR", "NL", "KR", "TW", "CA", "AU", "RU", "IN", "BR", "ZZ", ""]
+# Every 20th server has been offline for a long time; fake_panel stamps the current time over LIVE_LAST_ACTIVE
+LIVE_LAST_ACTIVE = "2000-01-01T00:00:00Z"
+OFFLINE_LAST_ACTIVE = "2024-01-01T00:00:00Z"
+
+
+def make_server(sid: int, rnd: random.Random) -> Dict[str, Any]:
+    """One server entry shaped like a Nezha v1 /api/v1/ws/server item."""
+    return {
+        "id": sid,
+        "name": f"node-{sid}",
+        "public_note": "",
+        "display_index": 0,
+        "host": {
+            "platform": "debian", "platform_version": "12", "cpu": ["AMD EPYC 7B13 2-Core Virtual CPU"],
+            "mem_total": 2 * 1024 ** 3, "disk_total": 40 * 1024 ** 3, "swap_total": 0,
+            "arch": "x86_64", "virtualization": "kvm", "boot_time": 1700000000,
+            "version": "1.0.0", "CountryCode": rnd.choice(CODES).lower(),
+        },
+        "state": {
+            "cpu": rnd.random() * 100, "mem_used": rnd.randrange(2 * 1024 ** 3), "swap_used": 0,
+            "disk_used": rnd.randrange(40 * 1024 ** 3), "net_in_transfer": rnd.randrange(10 ** 12),
+            "net_out_transfer": rnd.randrange(10 ** 12), "net_in_speed": rnd.randrange(10 ** 8),
+            "net_out_speed": rnd.randrange(10 ** 8), "uptime": rnd.randrange(10 ** 7),
+            "load_1": rnd.random(), "load_5": rnd.random(), "load_15": rnd.random(),
+            "tcp_conn_count": rnd.randrange(1000), "udp_conn_count": rnd.randrange(100),
+            "process_count": rnd.randrange(300), "temperatures": None, "gpu": None,
+        },
+        "country_code": "",
+        "last_active": OFFLINE_LAST_ACTIVE if sid % 20 == 19 else LIVE_LAST_ACTIVE,
+    }
+
+
+def make_servers(n: int, seed: int = 1) -> List[Dict[str, Any]]:
+    rnd = random.Random(seed)
+    return [make_server(i, rnd) for i in range(n)]
+
+
+def next_frame(servers: List[Dict[str, Any]], changed_fraction: float, rnd: random.Random) -> List[Dict[str, Any]]:
+    """A new frame (fresh dicts, as json.loads would give) where a fraction of speeds moved."""
+    frame = []
+    for s in servers:
+        s = dict(s)
+        state = dict(s["state"])
+        if rnd.random() < changed_fraction:
+            state["net_in_speed"] = rnd.randrange(10 ** 8)
+            state["net_out_speed"] = rnd.randrange(10 ** 8)
+        s["state"] = state
+        frame.append(s)
+    return frame
+
+
+def make_frame(servers: List[Dict[str, Any]]) -> Dict[str, Any]:
+    return {"now": 1700000000000, "online": len(servers), "servers": servers}
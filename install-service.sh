@@ -91,6 +91,8 @@ WorkingDirectory=${SCRIPT_DIR}
 Environment=PATH=${VENV_DIR}/bin:/usr/local/sbin:/usr/local/bin:/usr/sbin:/usr/bin:/sbin:/bin
 Environment=VIRTUAL_ENV=${VENV_DIR}
 Environment=PYTHONPATH=${VENV_DIR}/lib/python${pyver}/site-packages
+StateDirectory=${SERVICE_NAME}
+Environment=SNAPSHOT_STATE_PATH=/var/lib/${SERVICE_NAME}/snapshot.bin
 EnvironmentFile=-${SCRIPT_DIR}/.env
 ExecStart=${PYTHON} ${SCRIPT_DIR}/app.py
 Restart=always
@@ -0,0 +1,9 @@
+"""Import app.py (and the bench helpers) without opening files or starting upstream threads."""
+import os
+import sys
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+
+os.environ["NEZHA_AUTOSTART"] = "false"
+sys.path.insert(0, ROOT)
+sys.path.insert(0, os.path.join(ROOT, "bench"))
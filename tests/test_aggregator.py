@@ -0,0 +1,84 @@
+"""CountryAggregator: equivalence with the full aggregation, federation dedup and renames."""
+import random
+
+from app import CountryAggregator, ServerRecord, aggregate_servers_to_countries, extract_servers, render_view
+from synthetic import make_servers, next_frame
+
+
+def _by_name(rows):
+    return {r["countryNameEN"]: r for r in rows}
+
+
+def _rec(sid, name, code="JP", out=1_000_000, inn=0):
+    return ServerRecord(sid, name, code, inn, out)
+
+
+def _uplink(agg, country="Japan"):
+    return _by_name(agg.countries()).get(country, {}).get("uplinkSpeed", 0)
+
+
+def test_matches_full_aggregation_across_frames():
+    rnd = random.Random(7)
+    base = make_servers(500, seed=7)
+    agg = CountryAggregator()
+    for i in range(20):
+        frame = next_frame(base, 0.3, rnd)
+        if i % 5 == 4:
+            frame = frame[: rnd.randrange(100, 500)]  # servers leave
+        agg.apply(extract_servers(frame))
+        assert _by_name(agg.countries()) == _by_name(aggregate_servers_to_countries(frame))
+
+
+def test_unchanged_frame_reports_no_change():
+    frame = extract_servers(make_servers(50))
+    agg = CountryAggregator()
+    assert agg.apply(frame)
+    assert not agg.apply(frame)
+
+
+def test_duplicate_id_in_one_frame_counts_once():
+    agg = CountryAggregator()
+    agg.apply([_rec(1, "a"), _rec(1, "a")])
+    assert _uplink(agg) == 8.0
+
+
+def test_dedup_counts_shared_server_once_and_hands_over():
+    agg = CountryAggregator(dedup=True)
+    agg.apply([_rec(1, "x")], scope=0)
+    agg.apply([_rec(9, "x")], scope=1)
+    assert _uplink(agg) == 8.0
+    agg.apply([], scope=0)  # panel 0 drops it; panel 1 counts it from its next frame
+    agg.apply([_rec(9, "x")], scope=1)
+    assert _uplink(agg) == 8.0
+
+
+def test_idle_rename_releases_claim():
+    agg = CountryAggregator(dedup=True)
+    agg.apply([_rec(1, "x")], scope=0)
+    agg.apply([_rec(9, "x", out=2_000_000)], scope=1)  # skipped: "x" is claimed by panel 0
+    agg.apply([_rec(1, "x2")], scope=0)  # same speeds, new name
+    agg.apply([_rec(9, "x", out=2_000_000)], scope=1)
+    assert _uplink(agg) == 24.0
+
+
+def test_claim_shared_by_two_ids_of_one_panel():
+    agg = CountryAggregator(dedup=True)
+    agg.apply([_rec(1, "x"), _rec(2, "x")], scope=0)
+    agg.apply([_rec(1, "x")], scope=0)  # one of the two leaves; the other still holds the name
+    agg.apply([_rec(9, "x", out=2_000_000)], scope=1)
+    assert _uplink(agg) == 8.0
+
+
+def test_unmapped_servers_count_in_status_and_top_only():
+    agg = CountryAggregator(track_online=True)
+    agg.apply([_rec(1, "a"), _rec(2, "b", code="", out=3_000_000), _rec(3, "c", code="ZZ", out=2_000_000)])
+    assert [c["countryNameEN"] for c in agg.countries()] == ["Japan"]
+    doc = agg.views(top=10)
+    assert render_view(doc, "status")["servers"] == 3
+    assert [s["countryNameEN"] for s in render_view(doc, "servers")] == ["Japan", "Unknown"]
+    assert render_view(doc, "servers")[-1]["servers"] == 2
+    assert [t["name"] for t in render_view(doc, "top", 10)] == ["b", "c", "a"]
+    assert render_view(doc, "top", 10)[0]["countryNameEN"] == "Unknown"
+    assert sum(c["servers"] for c in render_view(doc, "continent")) == 1
+    agg.apply([_rec(1, "a")])  # the unmapped ones leave
+    assert "unmapped" not in agg.views()
@@ -0,0 +1,52 @@
+"""Binary push frames: the layout clients decode, round trip and the country table it indexes."""
+import base64
+import json
+import struct
+
+from app import (BINARY_FORMAT, COUNTRY_TABLE, COUNTRY_TABLE_VERSION, SnapshotHub, app, decode_binary_frame,
+                 encode_binary_frame)
+
+COUNTRIES = [
+    {"countryNameEN": "Japan", "uplinkSpeed": 123.45, "downlinkSpeed": 0.01},
+    {"countryNameEN": "Atlantis", "uplinkSpeed": 1.0, "downlinkSpeed": 1.0},  # not in the table: left out
+    {"countryNameEN": "Egypt", "uplinkSpeed": 0.0, "downlinkSpeed": 98765.5},
+]
+
+
+def test_frame_layout_is_the_documented_contract():
+    frame = encode_binary_frame(2 ** 32 + 7, COUNTRIES)
+    # <HHII header: format, count, table version, snapshot version (low 32 bits); then float32 triples
+    assert frame[:12] == struct.pack("<HHII", BINARY_FORMAT, 2, COUNTRY_TABLE_VERSION, 7)
+    assert len(frame) == 12 + 2 * 12
+    index, up, _ = struct.unpack_from("<3f", frame, 12)
+    assert COUNTRY_TABLE[int(index)]["countryNameEN"] == "Japan" and abs(up - 123.45) < 1e-4
+
+
+def test_round_trip_through_the_country_table():
+    table_version, version, rows = decode_binary_frame(encode_binary_frame(42, COUNTRIES))
+    assert (table_version, version) == (COUNTRY_TABLE_VERSION, 42)
+    decoded = {COUNTRY_TABLE[i]["countryNameEN"]: (up, down) for i, up, down in rows}
+    assert set(decoded) == {"Japan", "Egypt"}
+    for c in COUNTRIES:
+        if c["countryNameEN"] in decoded:
+            up, down = decoded[c["countryNameEN"]]
+            # float32 on the wire
+            assert abs(up - c["uplinkSpeed"]) <= abs(c["uplinkSpeed"]) * 1e-6
+            assert abs(down - c["downlinkSpeed"]) <= abs(c["downlinkSpeed"]) * 1e-6
+
+
+def test_hub_binary_and_sse_frames_decode_to_the_published_version():
+    hub = SnapshotHub()
+    hub.publish(5, json.dumps(COUNTRIES), record_history=False)
+    version, frame, sse = hub.binary
+    assert version == 5 and decode_binary_frame(frame)[1] == 5
+    assert sse.startswith(b"data:") and base64.b64decode(sse[5:].strip()) == frame
+
+
+def test_country_table_endpoint_matches_the_frames():
+    resp = app.test_client().get("/api/v1/country-table")
+    assert resp.status_code == 200
+    table = resp.get_json()
+    assert table["version"] == COUNTRY_TABLE_VERSION and table["format"] == BINARY_FORMAT
+    assert table["countries"] == COUNTRY_TABLE
+    assert [c["i"] for c in table["countries"]] == list(range(len(COUNTRY_TABLE)))
@@ -0,0 +1,77 @@
+"""TrafficHistory: quantised min/avg/max, bounded wide queries and the shared history file."""
+import time
+
+from app import TrafficHistory
+
+
+def _row(name, up, down=0.0):
+    return {"countryNameEN": name, "uplinkSpeed": up, "downlinkSpeed": down}
+
+
+def _fill(history, start):
+    for i in range(120):
+        history.record([_row("Japan", 100.0 + i, 5.0)], start + i * 0.5)
+
+
+def test_min_avg_max_within_quantisation_error():
+    h = TrafficHistory(levels="1:10,10:60")  # the 1 s level keeps only a mean; 10 s keeps min/avg/max
+    start = (time.time() // 10) * 10 - 60
+    _fill(h, start)
+    out = h.query("Japan", start, start + 60, 10)
+    assert out["resolution"] == 10 and out["step"] == 10
+    up = out["uplinkSpeed"]
+    assert abs(up["min"][0] - 100.0) < 0.1
+    assert abs(up["avg"][0] - 109.5) < 0.1
+    assert abs(up["max"][0] - 119.0) < 0.1
+    assert all(abs(v - 5.0) < 0.01 for v in out["downlinkSpeed"]["avg"])
+
+
+def test_unknown_or_silent_country_is_empty():
+    h = TrafficHistory(levels="1:60")
+    h.record([_row("Japan", 1.0)], time.time())
+    assert h.countries() == ["Japan"]
+    assert h.query("Germany", 0, time.time(), None)["t"] == []
+    assert h.query("Nowhere", 0, time.time(), None)["t"] == []
+
+
+def test_huge_range_is_clamped_to_the_ring():
+    h = TrafficHistory(levels="1:60,10:60")
+    _fill(h, time.time() - 60)
+    t = time.perf_counter()
+    out = h.query("Japan", 0, 1e13, None)
+    assert time.perf_counter() - t < 0.5
+    assert 0 < len(out["t"]) <= 2
+
+
+def test_shared_file_is_read_by_another_process(tmp_path):
+    path = str(tmp_path / "snapshot.bin.history")
+    writer = TrafficHistory(levels="1:60,10:60", path=path)
+    start = time.time() - 60
+    _fill(writer, start)
+    reader = TrafficHistory(levels="1:60,10:60", path=path)
+    assert reader.countries() == ["Japan"]
+    assert reader.query("Japan", start, start + 60, 60)["uplinkSpeed"]["max"][0] > 100.0
+    # A different layout never reads the old file
+    assert TrafficHistory(levels="1:30", path=path).countries() == []
+
+
+def test_outage_is_left_empty_and_short_gaps_carry_the_last_sample():
+    h = TrafficHistory(levels="1:60,10:8640")
+    start = (time.time() // 10) * 10 - 7200
+    h.record([_row("Japan", 10.0)], start)
+    h.record([_row("Japan", 30.0)], start + 20)  # unchanged for 20 s: the 10 s buckets in between repeat 10.0
+    h.record([_row("Japan", 50.0)], start + 3600)  # an hour without data
+    out = h.query("Japan", start, start + 3610, 10)
+    # 30.0 stands in for HISTORY_CARRY_SECONDS (60) after its sample, then nothing until the next one
+    assert out["t"] == [start + k for k in range(0, 90, 10)] + [start + 3600]
+    assert out["uplinkSpeed"]["avg"][:4] == [10.0, 10.0, 30.0, 30.0]
+    assert abs(out["uplinkSpeed"]["avg"][-1] - 50.0) < 0.1
+
+
+def test_restart_does_not_fill_the_downtime(tmp_path):
+    path = str(tmp_path / "snapshot.bin.history")
+    start = (time.time() // 10) * 10 - 7200
+    TrafficHistory(levels="1:60,10:8640", path=path).record([_row("Japan", 10.0)], start)
+    restarted = TrafficHistory(levels="1:60,10:8640", path=path)
+    restarted.record([_row("Japan", 20.0)], start + 30)
+    assert restarted.query("Japan", start, start + 40, 10)["t"] == [start, start + 30]
@@ -0,0 +1,95 @@
+"""SnapshotHub delta mode: keyframe/patch chain, Last-Event-ID resume and epochs."""
+import json
+
+from app import SSE_DELTA_HISTORY, SnapshotHub
+
+
+def _body(speeds):
+    return json.dumps([{"countryNameEN": name, "countryNameEmojiCN": name, "uplinkSpeed": up,
+                        "downlinkSpeed": down, "coords": [0, 0]} for name, (up, down) in speeds.items()])
+
+
+def _event(frame):
+    fields = dict(line.split(":", 1) for line in frame.decode().strip().split("\n"))
+    return fields.get("event"), fields["id"], json.loads(fields["data"])
+
+
+def _apply(state, frames):
+    """Client side of delta mode: {name: [up, down]} after a keyframe or a run of patches."""
+    for frame in frames:
+        event, _, data = _event(frame)
+        if event == "keyframe":
+            state = {c["countryNameEN"]: [c["uplinkSpeed"], c["downlinkSpeed"]] for c in data}
+            continue
+        state = dict(state)
+        for name, speeds in data.get("set", {}).items():
+            state[name] = speeds
+        for c in data.get("add", []):
+            state[c["countryNameEN"]] = [c["uplinkSpeed"], c["downlinkSpeed"]]
+        for name in data.get("del", []):
+            del state[name]
+    return state
+
+
+def test_patches_carry_set_add_and_del():
+    hub = SnapshotHub()
+    hub.publish(1, _body({"Japan": (1, 2), "Egypt": (5, 5)}), record_history=False)
+    hub.publish(2, _body({"Japan": (3, 2), "Egypt": (5, 5), "Germany": (7, 8)}), record_history=False)
+    hub.publish(3, _body({"Germany": (7, 8), "Egypt": (5, 5)}), record_history=False)
+    _, frames = hub.delta_frames(1)
+    events = [_event(f) for f in frames]
+    assert [e[0] for e in events] == ["patch", "patch"]
+    germany = json.loads(_body({"Germany": (7, 8)}))[0]
+    assert events[0][2] == {"v": 2, "base": 1, "set": {"Japan": [3, 2]}, "add": [germany]}
+    assert events[1][2] == {"v": 3, "base": 2, "del": ["Japan"]}
+    assert hub.parse_event_id(events[1][1]) == 3
+
+
+def test_resume_within_the_ring_sends_only_missed_patches():
+    hub = SnapshotHub()
+    states = {}
+    for v in range(1, 6):
+        states[v] = {"Japan": [v, 0], "Egypt": [1, 1]} if v % 2 else {"Japan": [v, 0]}
+        hub.publish(v, _body({k: tuple(s) for k, s in states[v].items()}), record_history=False)
+    version, frames = hub.delta_frames(3)
+    assert version == 5 and len(frames) == 2
+    assert _apply(states[3], frames) == states[5]
+    assert hub.delta_frames(5) == (5, [])
+
+
+def test_resume_after_the_ring_rolled_over_gets_a_keyframe():
+    hub = SnapshotHub()
+    for v in range(1, SSE_DELTA_HISTORY + 3):
+        hub.publish(v, _body({"Japan": (v, 0)}), record_history=False)
+    version, frames = hub.delta_frames(1)
+    assert version == SSE_DELTA_HISTORY + 2
+    assert len(frames) == 1
+    event, event_id, _ = _event(frames[0])
+    assert event == "keyframe" and hub.parse_event_id(event_id) == version
+    assert _apply({}, frames) == {"Japan": [version, 0]}
+
+
+def test_foreign_epoch_is_not_resumed():
+    hub = SnapshotHub()
+    hub.publish(1, _body({"Japan": (1, 0)}), record_history=False)
+    hub.publish(2, _body({"Japan": (2, 0)}), record_history=False)
+    _, event_id, _ = _event(hub.delta_frames(0)[1][0])
+    epoch = int(event_id.split("-")[0])
+    assert hub.parse_event_id(f"{epoch}-1") == 1
+    assert hub.parse_event_id(f"{epoch + 1}-1") == -1
+    assert hub.parse_event_id("garbage") == -1
+    assert hub.parse_event_id(None) == -1
+    # A new epoch (shared segment recreated) drops the patch chain: old clients get a keyframe
+    hub.publish(3, _body({"Japan": (3, 0)}), epoch=epoch + 1, record_history=False)
+    assert hub.parse_event_id(f"{epoch}-2") == -1
+    assert [_event(f)[0] for f in hub.delta_frames(2)[1]] == ["keyframe"]
+
+
+def test_delta_stream_starts_from_last_event_id():
+    hub = SnapshotHub()
+    for v in range(1, 4):
+        hub.publish(v, _body({"Japan": (v, 0)}), record_history=False)
+    first = next(hub.stream(delta=True, last_version=2))
+    assert _event(first)[0] == "patch" and _event(first)[2]["base"] == 2
+    first = next(hub.stream(delta=True))
+    assert _event(first)[0] == "keyframe"
@@ -0,0 +1,18 @@
+"""Prometheus text exposition: label escaping per text format 0.0.4 and the metric class split."""
+import pytest
+
+from app import Counter, Gauge, _Metric
+
+
+def test_label_values_are_escaped():
+    c = Counter("test_escape_total", "Escaping test.", ("upstream",))
+    c.labels('a\\b"c\nd').inc()
+    assert c.render()[-1] == 'test_escape_total{upstream="a\\\\b\\"c\\nd"} 1.0'
+
+
+def test_gauge_has_no_labelled_children():
+    g = Gauge("test_gauge", "Gauge test.", lambda: [((("role", "owner"),), 1)])
+    assert not hasattr(g, "labels")
+    assert g.render()[-1] == 'test_gauge{role="owner"} 1.0'
+    with pytest.raises(TypeError):
+        _Metric("test_abstract", "Abstract.")
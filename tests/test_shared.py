@@ -0,0 +1,89 @@
+"""SharedSnapshot seqlock segment, owner handover, and the warm-start restore/adopt rules."""
+import time
+
+from app import NezhaStreamer, PanelConfig, SharedSnapshot, SnapshotHub
+
+BODY = '[{"countryNameEN": "Japan", "countryNameEmojiCN": "JP", "uplinkSpeed": 1.5, "downlinkSpeed": 2, "coords": [0, 0]}]'
+VIEWS = '{"countries": {"Japan": [1, 2, 1, 1]}}'
+
+
+def _segment(tmp_path, name="snapshot.bin"):
+    return SharedSnapshot(str(tmp_path / name), 256 * 1024)
+
+
+def test_publish_read_round_trip(tmp_path):
+    owner = _segment(tmp_path)
+    reader = _segment(tmp_path)
+    assert reader.read() == ("[]", 0.0, 0.0, 0, 0, "")
+    owner.publish(BODY, 1, 100.0, 99.0, 3, meta='{"upstreams": []}', views=VIEWS)
+    assert reader.read() == (BODY, 100.0, 99.0, 3, 1, VIEWS)
+    assert reader.read_meta() == '{"upstreams": []}'
+    # Same version again only refreshes the header; the segment version does not move
+    owner.publish(BODY, 1, 101.0, 100.0, 3)
+    assert reader.read()[1:5] == (101.0, 100.0, 3, 1)
+    owner.publish("[]", 2, 102.0, 100.0, 0)
+    assert reader.read()[0] == "[]" and reader.read()[4] == 2
+
+
+def test_torn_write_is_never_served(tmp_path):
+    owner = _segment(tmp_path)
+    reader = _segment(tmp_path)
+    owner.publish(BODY, 1, 100.0, 99.0, 3, views=VIEWS)
+    assert reader.read()[0] == BODY
+    # Writer died mid-publish: odd seq, body half overwritten
+    _, _, seq, version, built_at, last_msg_ts, count, length, epoch, meta_length, views_length = owner._unpack()
+    owner._pack(seq + 1, version, built_at, last_msg_ts, count, length, epoch, meta_length, views_length)
+    owner._mm[SharedSnapshot._DATA_OFFSET:SharedSnapshot._DATA_OFFSET + 8] = b"garbage!"
+    body, _, _, _, seen_version, views = reader.read()
+    assert (body, seen_version, views) == (BODY, 1, VIEWS)  # the last consistent copy
+    assert _segment(tmp_path).read()[0] == "[]"  # a reader without one gets nothing, not garbage
+    # The next complete publish heals the segment
+    owner.publish(BODY.replace("1.5", "2.5"), 2, 101.0, 100.0, 3, views=VIEWS)
+    assert "2.5" in reader.read()[0]
+
+
+def test_new_owner_continues_the_segment_version(tmp_path):
+    first = _segment(tmp_path)
+    for v in range(1, 4):
+        first.publish(BODY, v, 100.0 + v, 100.0, 3)
+    epoch = first.epoch()
+    reader = _segment(tmp_path)
+    assert reader.read()[4] == 3
+    # The new owner's streamer starts again at version 1; readers must still see something newer
+    second = _segment(tmp_path)
+    second.publish("[]", 1, 200.0, 200.0, 0)
+    assert reader.read()[0] == "[]" and reader.read()[4] == 4
+    assert second.epoch() == epoch
+
+
+def _streamer(tmp_path, shared=None, state=None, hub=None):
+    return NezhaStreamer(shared=shared, state=state, hub=hub,
+                         panels=[PanelConfig("http://127.0.0.1:9", "u", "p")])
+
+
+def test_restore_publishes_saved_state_and_skips_empty(tmp_path):
+    state = _segment(tmp_path, "state.bin")
+    assert _streamer(tmp_path, state=state).restored_at() is None  # nothing saved yet
+    built_at = time.time() - 30
+    state.publish(BODY, 7, built_at, built_at, 3, views=VIEWS)
+    hub = SnapshotHub()
+    streamer = _streamer(tmp_path, state=state, hub=hub)
+    assert streamer.restored_at() == built_at
+    assert streamer.snapshot()[0] == BODY and streamer.snapshot()[2] == 3
+    assert hub.version == state.read()[4]  # live versions continue after the restored one
+    state.publish("[]", 8, built_at, built_at, 0)
+    assert _streamer(tmp_path, state=_segment(tmp_path, "state.bin")).restored_at() is None
+
+
+def test_new_owner_adopts_only_a_newer_shared_snapshot(tmp_path):
+    now = time.time()
+    state = _segment(tmp_path, "state.bin")
+    state.publish(BODY, 5, now - 60, now - 60, 3)
+    shared = _segment(tmp_path)
+    shared.publish("[]", 9, now - 600, now - 600, 0)  # previous owner's data, older than the state file
+    streamer = _streamer(tmp_path, shared=shared, state=state)
+    streamer._adopt_shared()
+    assert streamer.snapshot()[0] == BODY and streamer.restored_at() == now - 60
+    shared.publish(BODY.replace("1.5", "9.5"), 10, now, now, 3)  # a fresher one wins over the boot-time restore
+    streamer._adopt_shared()
+    assert "9.5" in streamer.snapshot()[0] and streamer.restored_at() is None
@@ -0,0 +1,111 @@
+"""Reconnect backoff: delays, and no hot loop against a panel that hangs up right after the handshake."""
+import asyncio
+import base64
+import hashlib
+import socket
+import threading
+import time
+
+import pytest
+
+from app import Backoff, NezhaStreamer, PanelConfig
+
+_WS_GUID = b"258EAFA5-E914-47DA-95CA-C5AB0DC85B11"
+
+
+def test_backoff_first_retry_immediate_then_capped():
+    b = Backoff(base=1.0, cap=4.0, factor=2.0)
+    assert b.next() == 0.0
+    delays = [b.next() for _ in range(10)]
+    assert 0.5 <= delays[0] <= 1.0
+    assert 1.0 <= delays[1] <= 2.0
+    assert all(2.0 <= d <= 4.0 for d in delays[3:])
+    b.reset()
+    assert b.next() == 0.0
+
+
+class _HangUpPanel:
+    """Answers every websocket upgrade with 101, optionally sends one text frame, then closes."""
+
+    def __init__(self, frame: bytes = b"") -> None:
+        self.frame = frame
+        self.connections = 0
+        self._sock = socket.socket()
+        self._sock.bind(("127.0.0.1", 0))
+        self._sock.listen(64)
+        self.url = f"http://127.0.0.1:{self._sock.getsockname()[1]}"
+        threading.Thread(target=self._serve, daemon=True).start()
+
+    def _serve(self) -> None:
+        while True:
+            try:
+                conn, _ = self._sock.accept()
+            except OSError:
+                return
+            with conn:
+                request = b""
+                while b"\r\n\r\n" not in request:
+                    chunk = conn.recv(4096)
+                    if not chunk:
+                        break
+                    request += chunk
+                key = next((line.split(b":", 1)[1].strip() for line in request.split(b"\r\n")
+                            if line.lower().startswith(b"sec-websocket-key:")), b"")
+                accept = base64.b64encode(hashlib.sha1(key + _WS_GUID).digest())
+                conn.sendall(b"HTTP/1.1 101 Switching Protocols\r\nUpgrade: websocket\r\nConnection: Upgrade\r\n"
+                             b"Sec-WebSocket-Accept: " + accept + b"\r\n\r\n")
+                if self.frame:
+                    conn.sendall(bytes([0x81, len(self.frame)]) + self.frame)
+                self.connections += 1
+
+    def close(self) -> None:
+        self._sock.close()
+
+
+def _upstream(streamer_class, url):
+    streamer = streamer_class(panels=[PanelConfig(url, "u", "p")])
+    upstream = streamer._upstreams[0]
+    upstream._ensure_session = lambda: True
+    return streamer, upstream
+
+
+def test_handshake_then_close_is_backed_off():
+    panel = _HangUpPanel()
+    streamer, upstream = _upstream(NezhaStreamer, panel.url)
+    threading.Thread(target=upstream._ws_loop, daemon=True).start()
+    time.sleep(1.5)
+    streamer._stop.set()
+    panel.close()
+    # 0 s, then 0.5-1 s, then 0.85-1.7 s: at most three attempts, not one per millisecond
+    assert 1 <= panel.connections <= 3
+
+
+def test_frame_resets_backoff():
+    panel = _HangUpPanel(frame=b"[]")
+    streamer, upstream = _upstream(NezhaStreamer, panel.url)
+    threading.Thread(target=upstream._ws_loop, daemon=True).start()
+    time.sleep(1.0)
+    streamer._stop.set()
+    panel.close()
+    # Every connection delivered a frame, so every retry after it is immediate again
+    assert panel.connections > 3
+
+
+def test_async_handshake_then_close_is_backed_off():
+    pytest.importorskip("aiohttp")
+    from aiohttp import ClientSession
+    from app_async import AsyncStreamer
+
+    panel = _HangUpPanel()
+    _, upstream = _upstream(AsyncStreamer, panel.url)
+
+    async def run():
+        async with ClientSession() as session:
+            try:
+                await asyncio.wait_for(upstream.run(session), 1.5)
+            except asyncio.TimeoutError:
+                pass
+
+    asyncio.run(run())
+    panel.close()
+    assert 1 <= panel.connections <= 3
@@ -0,0 +1,29 @@
+"""Traffic views: last_active parsing and rendering from a views() document."""
+from datetime import datetime, timezone
+
+from app import _parse_last_active, render_view
+
+T0 = datetime(2024, 10, 17, 0, 0, 0, tzinfo=timezone.utc).timestamp()
+
+
+def test_parse_last_active_rfc3339nano():
+    assert _parse_last_active("2024-10-17T00:00:00Z") == T0
+    assert _parse_last_active("2024-10-17T08:00:00+08:00") == T0
+    assert abs(_parse_last_active("2024-10-17T08:00:00.123456789+08:00") - (T0 + 0.123456)) < 1e-6
+    assert abs(_parse_last_active("2024-10-17T00:00:00.5Z") - (T0 + 0.5)) < 1e-6
+    assert _parse_last_active("0001-01-01T00:00:00Z") < 0  # never seen: offline
+
+
+def test_parse_last_active_missing_counts_as_online():
+    assert _parse_last_active(None) == float("inf")
+    assert _parse_last_active("garbage") == float("inf")
+
+
+def test_render_views():
+    doc = {"countries": {"Japan": [1e6, 2e6, 3, 2], "Germany": [125000, 0, 1, 1]},
+           "top": [[1, "a", "Japan", 5e5, 5e5, True], [2, "b", "Germany", 125000, 0, False]]}
+    assert render_view(doc, "status") == {"servers": 4, "online": 3, "offline": 1}
+    continents = {c["continent"]: c for c in render_view(doc, "continent")}
+    assert continents["Asia"]["uplinkSpeed"] == 8.0 and continents["Europe"]["servers"] == 1
+    assert [t["id"] for t in render_view(doc, "top", 1, "bytes")] == [1]
+    assert render_view(doc, "countries", unit="bps")[0]["downlinkSpeed"] == 16_000_000